@@ -0,0 +1,74 @@
+"""启动耗时基准测试
+
+使用 ``python -X importtime`` 统计导入 onebot_client 的耗时，并列出最耗时的模块。
+同时测量 start.py 依赖检查（find_spec）与旧版直接导入全部依赖的耗时对比。
+
+用法：python bench_startup.py [--runs N] [--top N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(statement):
+    """在新的解释器中执行 statement，返回 {模块名: (自身耗时us, 累计耗时us)}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=HERE, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(statement, runs):
+    """多次运行取中位数，返回 (总导入耗时us, 最后一次的模块耗时)"""
+    totals = []
+    times = {}
+    for _ in range(runs):
+        times = import_times(statement)
+        totals.append(sum(self_us for self_us, _ in times.values()))
+    return statistics.median(totals), times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OneBot11客户端启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="每项测量的运行次数")
+    parser.add_argument("--top", type=int, default=10, help="列出最耗时的模块数量")
+    args = parser.parse_args()
+
+    total, times = measure("import onebot_client", args.runs)
+    print(f"导入 onebot_client: {total / 1000:.1f} ms（{args.runs}次中位数）")
+    print(f"最耗时的{args.top}个模块（累计耗时）:")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda x: -x[1][1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    # 启动时不应导入的大型库
+    heavy = [name for name in ("PIL", "requests", "websockets") if name in times]
+    print(f"启动时导入的大型库: {', '.join(heavy) if heavy else '无'}")
+
+    checks = [
+        ("依赖检查 find_spec", "import importlib.util; [importlib.util.find_spec(m) for m in ('websockets', 'psutil', 'requests', 'PIL')]"),
+        ("依赖检查 直接导入", "import websockets, psutil, requests, PIL"),
+    ]
+    for label, statement in checks:
+        try:
+            total, _ = measure(statement, args.runs)
+            print(f"{label}: {total / 1000:.1f} ms")
+        except RuntimeError as e:
+            print(f"{label}: 无法测量（{e}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+import bisect
+import datetime
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+from collections import OrderedDict, deque
+
+# 索引文件中每条记录的格式：消息在归档文件中的字节偏移
+INDEX_RECORD = struct.Struct("<Q")
+# 时间索引中每条记录的格式：消息的时间戳
+TIME_RECORD = struct.Struct("<q")
+
+
+class ChatMessage:
+    """一条聊天消息
+
+    使用 ``__slots__`` 减少每条消息的内存占用，发送者ID和昵称经过驻留（intern），
+    同一个人的大量消息共享同一个字符串对象。时间保存为整数时间戳，只在显示时格式化。
+    """
+
+    __slots__ = ("timestamp", "sender_id", "sender", "content", "is_self", "message_id")
+
+    def __init__(self, timestamp, sender_id, sender, content, is_self=False, message_id=None):
+        self.timestamp = int(timestamp)
+        self.sender_id = sys.intern(str(sender_id)) if sender_id else ""
+        self.sender = sys.intern(sender or "")
+        self.content = content
+        self.is_self = bool(is_self)
+        self.message_id = message_id
+
+    def format_time(self):
+        """格式化消息时间，今天的消息只显示时分秒"""
+        moment = datetime.datetime.fromtimestamp(self.timestamp)
+        if moment.date() == datetime.date.today():
+            return moment.strftime("%H:%M:%S")
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+    def to_dict(self):
+        return {
+            "message_id": self.message_id,
+            "timestamp": self.timestamp,
+            "sender_id": self.sender_id,
+            "sender": self.sender,
+            "content": self.content,
+            "is_self": self.is_self
+        }
+
+    @classmethod
+    def from_dict(cls, data, timestamp=None):
+        """从保存的记录创建消息，旧版记录没有时间戳时使用传入的 timestamp"""
+        if "timestamp" in data:
+            timestamp = data["timestamp"]
+        return cls(
+            timestamp or 0,
+            data.get("sender_id", ""),
+            data.get("sender", ""),
+            data.get("content", ""),
+            data.get("is_self", False),
+            data.get("message_id")
+        )
+
+
+def legacy_timestamps(time_strs, reference):
+    """根据旧版记录中的 "%H:%M:%S" 时间推算时间戳
+
+    旧版记录只有时分秒，这里以文件修改时间为最后一条消息的日期，
+    从后往前推算，时间出现倒退时认为跨过了一天。
+    """
+    day = datetime.date.fromtimestamp(reference)
+    later = reference
+    result = []
+    for time_str in reversed(time_strs):
+        try:
+            clock = datetime.datetime.strptime(time_str, "%H:%M:%S").time()
+        except (TypeError, ValueError):
+            result.append(int(later))
+            continue
+        timestamp = datetime.datetime.combine(day, clock).timestamp()
+        if timestamp > later:
+            day -= datetime.timedelta(days=1)
+            timestamp = datetime.datetime.combine(day, clock).timestamp()
+        result.append(int(timestamp))
+        later = timestamp
+    result.reverse()
+    return result
+
+
+def load_messages(records, reference):
+    """把保存的记录转换为 ChatMessage 列表，兼容旧版记录格式"""
+    legacy = [r.get("time") for r in records if "timestamp" not in r]
+    fallback = iter(legacy_timestamps(legacy, reference)) if legacy else None
+    return [
+        ChatMessage.from_dict(r, None if "timestamp" in r else next(fallback))
+        for r in records
+    ]
+
+
+class ChatStorage:
+    """聊天记录存储层
+
+    每个对话在内存中只保留最近的一段消息（窗口），超出窗口的旧消息按顺序
+    追加到磁盘上的归档文件，需要时再按位置读回。
+
+    - ``<id>.json``：对话信息和内存窗口内的消息（旧版格式的文件加载时会自动转换）
+    - ``<id>.archive.jsonl``：溢出的旧消息，每行一条
+    - ``<id>.archive.idx``：归档中每条消息的字节偏移，定长记录，可直接定位
+    - ``<id>.archive.tidx``：归档中每条消息的时间戳，与 ``.idx`` 一一对应，用于按时间二分查找
+    - ``<id>.archive.pending``：向归档中间插入消息时重写的尾部，只在写入过程中存在
+
+    消息位置是对话内的全局序号：``[0, 归档数量)`` 在归档中，其后是内存窗口。
+    消息按时间戳有序，因此位置和时间可以互相换算。
+    """
+
+    def __init__(self, history_dir="chat_history", window_messages=200, window_bytes=256 * 1024):
+        self.history_dir = history_dir
+        self.window_messages = max(1, int(window_messages))
+        self.window_bytes = max(1, int(window_bytes))
+        self.lock = threading.RLock()
+        self._checked_indexes = set()  # 本次运行中已校验过的归档索引
+
+    def _path(self, conversation_id, suffix):
+        return os.path.join(self.history_dir, f"{conversation_id}{suffix}")
+
+    def _ensure_dir(self):
+        if not os.path.exists(self.history_dir):
+            os.makedirs(self.history_dir)
+
+    @staticmethod
+    def _message_size(msg):
+        """估算一条消息占用的字节数（无需序列化）"""
+        return len(msg.content) * 3 + 96
+
+    def load_all(self):
+        """加载全部对话，超出窗口的历史消息会被移入归档"""
+        return list(self.iter_all())
+
+    def iter_all(self):
+        """逐个加载对话，不需要同时保留所有对话时使用"""
+        self._ensure_dir()
+        for filename in sorted(os.listdir(self.history_dir)):
+            if filename.endswith(".json"):
+                conv = self.load(filename[:-len(".json")])
+                if conv is not None:
+                    yield conv
+
+    def load(self, conversation_id):
+        """加载一个对话，不存在或无法读取时返回 None"""
+        path = self._path(conversation_id, ".json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                conv = json.load(f)
+            records = conv.get("messages", [])
+            conv["messages"] = load_messages(records, os.path.getmtime(path))
+        except Exception as e:
+            print(f"加载聊天记录失败: {os.path.basename(path)}, {e}")
+            return None
+
+        # 旧版记录文件包含全部消息，首次加载时裁剪并写回
+        legacy = any("timestamp" not in r for r in records)
+        if self.trim(conv) or legacy:
+            self._write_window(conv)
+        return conv
+
+    def append(self, conv, msg):
+        """按时间顺序把消息加入内存窗口，返回插入的位置（窗口内）
+
+        比归档中最新一条消息还早的乱序消息直接插入归档中的对应位置（返回 None），
+        保证归档始终按时间有序，按时间二分查找的结果才正确。
+        """
+        with self.lock:
+            messages = conv.setdefault("messages", [])
+            if not messages or msg.timestamp < messages[0].timestamp:
+                archive_end = self.archive_end_time(conv["id"])
+                if archive_end is not None and msg.timestamp < archive_end:
+                    self._insert_archive(conv["id"], msg)
+                    return None
+            if not messages or msg.timestamp >= messages[-1].timestamp:
+                messages.append(msg)
+                return len(messages) - 1
+            # 乱序到达的消息按时间戳插入
+            index = bisect.bisect_right([m.timestamp for m in messages], msg.timestamp)
+            messages.insert(index, msg)
+            return index
+
+    def save(self, conv):
+        """裁剪内存窗口并保存对话"""
+        with self.lock:
+            self.trim(conv)
+            self._write_window(conv)
+
+    def _write_window(self, conv):
+        self._ensure_dir()
+        path = self._path(conv["id"], ".json")
+        tmp_path = path + ".tmp"
+        data = dict(conv)
+        data["messages"] = [m.to_dict() for m in conv.get("messages", [])]
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def trim(self, conv):
+        """把超出窗口限制的旧消息移入归档，返回移出的条数"""
+        with self.lock:
+            messages = conv.setdefault("messages", [])
+            cid = conv["id"]
+            size = sum(self._message_size(m) for m in messages)
+
+            spill = max(0, len(messages) - self.window_messages)
+            for msg in messages[:spill]:
+                size -= self._message_size(msg)
+            # 按字节数继续裁剪，但至少保留最新的一条消息
+            while spill < len(messages) - 1 and size > self.window_bytes:
+                size -= self._message_size(messages[spill])
+                spill += 1
+
+            if spill:
+                self._append_archive(cid, messages[:spill])
+                del messages[:spill]
+            return spill
+
+    def _append_archive(self, conversation_id, messages):
+        self._ensure_dir()
+        self._check_index(conversation_id)
+        archive_path = self._path(conversation_id, ".archive.jsonl")
+        with open(archive_path, 'ab') as archive, \
+                open(self._path(conversation_id, ".archive.idx"), 'ab') as index, \
+                open(self._path(conversation_id, ".archive.tidx"), 'ab') as time_index:
+            offset = archive.tell()
+            records = []
+            for msg in messages:
+                line = (json.dumps(msg.to_dict(), ensure_ascii=False) + "\n").encode('utf-8')
+                archive.write(line)
+                records.append(INDEX_RECORD.pack(offset))
+                offset += len(line)
+            archive.flush()
+            os.fsync(archive.fileno())
+            index.write(b"".join(records))
+            time_index.write(b"".join(TIME_RECORD.pack(msg.timestamp) for msg in messages))
+
+    def _insert_archive(self, conversation_id, msg):
+        """把乱序到达的旧消息插入归档中按时间排序的位置
+
+        只重写插入位置之后的部分（乱序通常只差几条，尾部很短）。新的尾部先完整写入
+        ``.archive.pending``，再截断归档并追加；中途退出时由 ``_check_index`` 根据
+        pending 文件完成写入并重建索引。
+        """
+        count = self.archived_count(conversation_id)
+        archive_path = self._path(conversation_id, ".archive.jsonl")
+        index_path = self._path(conversation_id, ".archive.idx")
+        time_index_path = self._path(conversation_id, ".archive.tidx")
+        with open(time_index_path, 'rb') as f:
+            position = bisect.bisect_right(_TimeIndex(f, count), msg.timestamp)
+        with open(index_path, 'rb') as f:
+            f.seek(position * INDEX_RECORD.size)
+            offset, = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+        with open(archive_path, 'rb') as archive:
+            archive.seek(offset)
+            tail = archive.read()
+
+        line = (json.dumps(msg.to_dict(), ensure_ascii=False) + "\n").encode('utf-8')
+        pending_path = self._path(conversation_id, ".archive.pending")
+        with open(pending_path + ".tmp", 'wb') as f:
+            f.write(f"{offset}\n".encode())
+            f.write(line)
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pending_path + ".tmp", pending_path)
+        self._apply_pending(conversation_id)
+
+        # 插入位置之后的偏移整体后移一条记录的长度，时间戳顺延一位
+        with open(index_path, 'r+b') as index:
+            index.seek(position * INDEX_RECORD.size)
+            shifted = [INDEX_RECORD.pack(offset)]
+            shifted.extend(INDEX_RECORD.pack(o + len(line)) for o, in INDEX_RECORD.iter_unpack(index.read()))
+            index.seek(position * INDEX_RECORD.size)
+            index.write(b"".join(shifted))
+        with open(time_index_path, 'r+b') as time_index:
+            time_index.seek(position * TIME_RECORD.size)
+            rest = time_index.read()
+            time_index.seek(position * TIME_RECORD.size)
+            time_index.write(TIME_RECORD.pack(msg.timestamp) + rest)
+        os.remove(pending_path)
+
+    def _apply_pending(self, conversation_id):
+        """把 pending 文件中的尾部写入归档（可重复执行）"""
+        with open(self._path(conversation_id, ".archive.pending"), 'rb') as pending, \
+                open(self._path(conversation_id, ".archive.jsonl"), 'r+b') as archive:
+            offset = int(pending.readline())
+            archive.truncate(offset)
+            archive.seek(offset)
+            shutil.copyfileobj(pending, archive)
+            archive.flush()
+            os.fsync(archive.fileno())
+
+    def _check_index(self, conversation_id):
+        """确认归档索引与归档文件一致，不一致时重建（例如上次写入中途退出）"""
+        if conversation_id in self._checked_indexes:
+            return
+        self._checked_indexes.add(conversation_id)
+
+        archive_path = self._path(conversation_id, ".archive.jsonl")
+        index_path = self._path(conversation_id, ".archive.idx")
+        time_index_path = self._path(conversation_id, ".archive.tidx")
+        pending_path = self._path(conversation_id, ".archive.pending")
+        if os.path.exists(pending_path + ".tmp"):
+            # 尾部还没写完整，归档没有被修改过
+            os.remove(pending_path + ".tmp")
+        if os.path.exists(pending_path):
+            # 上次插入消息时中途退出：完成归档的写入，索引在下面重建
+            print(f"完成未写完的归档插入: {conversation_id}")
+            if os.path.exists(archive_path):
+                self._apply_pending(conversation_id)
+            os.remove(pending_path)
+            for path in (index_path, time_index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        if not os.path.exists(archive_path):
+            for path in (index_path, time_index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        archive_size = os.path.getsize(archive_path)
+        index_size = os.path.getsize(index_path) if os.path.exists(index_path) else 0
+        time_index_size = os.path.getsize(time_index_path) if os.path.exists(time_index_path) else 0
+        records_match = index_size // INDEX_RECORD.size == time_index_size // TIME_RECORD.size
+        if index_size and index_size % INDEX_RECORD.size == 0 and records_match:
+            with open(index_path, 'rb') as index, open(archive_path, 'rb') as archive:
+                index.seek(index_size - INDEX_RECORD.size)
+                last_offset, = INDEX_RECORD.unpack(index.read(INDEX_RECORD.size))
+                archive.seek(last_offset)
+                archive.readline()
+                if archive.tell() == archive_size:
+                    return
+        elif index_size == 0 and archive_size == 0:
+            return
+
+        print(f"重建归档索引: {conversation_id}")
+        with open(archive_path, 'r+b') as archive, open(index_path, 'wb') as index, \
+                open(time_index_path, 'wb') as time_index:
+            offset = 0
+            timestamp = 0
+            for line in archive:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    timestamp = json.loads(line).get("timestamp", timestamp)
+                except ValueError:
+                    pass
+                index.write(INDEX_RECORD.pack(offset))
+                time_index.write(TIME_RECORD.pack(timestamp))
+                offset += len(line)
+            # 丢弃末尾写了一半的记录，避免后续追加时与之粘连
+            archive.truncate(offset)
+
+    def archived_count(self, conversation_id):
+        """归档中的消息条数"""
+        with self.lock:
+            self._check_index(conversation_id)
+            index_path = self._path(conversation_id, ".archive.idx")
+            if not os.path.exists(index_path):
+                return 0
+            return os.path.getsize(index_path) // INDEX_RECORD.size
+
+    def archive_end_time(self, conversation_id):
+        """归档中最新一条消息的时间戳，没有归档时返回 None"""
+        with self.lock:
+            count = self.archived_count(conversation_id)
+            if not count:
+                return None
+            with open(self._path(conversation_id, ".archive.tidx"), 'rb') as f:
+                f.seek((count - 1) * TIME_RECORD.size)
+                timestamp, = TIME_RECORD.unpack(f.read(TIME_RECORD.size))
+            return timestamp
+
+    def total_count(self, conv):
+        """对话的消息总数（归档 + 内存窗口）"""
+        return self.archived_count(conv["id"]) + len(conv.get("messages", []))
+
+    def read_messages(self, conv, start, end):
+        """读取位置在 [start, end) 范围内的消息，归档部分只读取需要的片段"""
+        with self.lock:
+            archived = self.archived_count(conv["id"])
+            start = max(0, start)
+            end = min(end, archived + len(conv.get("messages", [])))
+            if start >= end:
+                return []
+
+            result = []
+            if start < archived:
+                result.extend(self._read_archive(conv["id"], start, min(end, archived)))
+            if end > archived:
+                result.extend(conv["messages"][max(0, start - archived):end - archived])
+            return result
+
+    def position_at(self, conv, timestamp):
+        """返回第一条时间不早于 timestamp 的消息位置，二分查找只读取索引中的少量记录"""
+        with self.lock:
+            archived = self.archived_count(conv["id"])
+            if archived:
+                with open(self._path(conv["id"], ".archive.tidx"), 'rb') as f:
+                    position = bisect.bisect_left(_TimeIndex(f, archived), timestamp)
+                if position < archived:
+                    return position
+            messages = conv.get("messages", [])
+            return archived + bisect.bisect_left([m.timestamp for m in messages], timestamp)
+
+    def read_range(self, conv, start_time, end_time, limit=None):
+        """读取时间在 [start_time, end_time) 内的消息，返回 (起始位置, 消息列表)"""
+        with self.lock:
+            start = self.position_at(conv, start_time)
+            end = self.position_at(conv, end_time)
+            if limit is not None:
+                end = min(end, start + limit)
+            return start, self.read_messages(conv, start, end)
+
+    def find_message(self, conv, timestamp, message_id=None):
+        """查找指定时间（及消息ID）的消息，返回 (位置, 消息)，找不到时消息为 None"""
+        with self.lock:
+            position = self.position_at(conv, timestamp)
+            candidates = self.read_messages(conv, position, position + 20)
+            for offset, msg in enumerate(candidates):
+                if msg.timestamp != timestamp:
+                    break
+                if message_id is None or msg.message_id == message_id:
+                    return position + offset, msg
+            return position, None
+
+    def iter_messages(self, conv, start_time=None, end_time=None, batch_size=1000):
+        """按时间顺序逐批读取 [start_time, end_time) 内的消息，内存中只保留一批"""
+        with self.lock:
+            start = 0 if start_time is None else self.position_at(conv, start_time)
+            end = self.total_count(conv) if end_time is None else self.position_at(conv, end_time)
+        while start < end:
+            batch = self.read_messages(conv, start, min(end, start + batch_size))
+            if not batch:
+                break
+            yield from batch
+            start += len(batch)
+
+    def rewrite(self, conv, messages):
+        """用按时间排序的消息流替换对话的全部记录，返回消息总数
+
+        消息逐条写入新的归档文件，内存中只保留最后一个窗口的消息；全部写完后才替换原文件，
+        因此 messages 可以是正在读取原记录的迭代器。消息顺序错误时放弃写入并抛出 ValueError。
+        """
+        with self.lock:
+            self._ensure_dir()
+            cid = conv["id"]
+            paths = [self._path(cid, suffix) for suffix in (".archive.jsonl", ".archive.idx", ".archive.tidx")]
+            window = deque()
+            count = 0
+            last_timestamp = None
+            try:
+                with open(paths[0] + ".tmp", 'wb') as archive, open(paths[1] + ".tmp", 'wb') as index, \
+                        open(paths[2] + ".tmp", 'wb') as time_index:
+                    for msg in messages:
+                        if last_timestamp is not None and msg.timestamp < last_timestamp:
+                            raise ValueError(f"消息没有按时间排序: {cid}")
+                        last_timestamp = msg.timestamp
+                        window.append(msg)
+                        count += 1
+                        if len(window) > self.window_messages:
+                            old = window.popleft()
+                            index.write(INDEX_RECORD.pack(archive.tell()))
+                            time_index.write(TIME_RECORD.pack(old.timestamp))
+                            archive.write((json.dumps(old.to_dict(), ensure_ascii=False) + "\n").encode('utf-8'))
+                    archive.flush()
+                    os.fsync(archive.fileno())
+            except BaseException:
+                for path in paths:
+                    if os.path.exists(path + ".tmp"):
+                        os.remove(path + ".tmp")
+                raise
+
+            for path in paths:
+                os.replace(path + ".tmp", path)
+            self._checked_indexes.discard(cid)
+            conv["messages"] = list(window)
+            # 窗口按字节数的限制由 save 继续裁剪
+            self.save(conv)
+            return count
+
+    def _read_archive(self, conversation_id, start, end):
+        with open(self._path(conversation_id, ".archive.idx"), 'rb') as index:
+            index.seek(start * INDEX_RECORD.size)
+            offset, = INDEX_RECORD.unpack(index.read(INDEX_RECORD.size))
+
+        records = []
+        archive_path = self._path(conversation_id, ".archive.jsonl")
+        with open(archive_path, 'rb') as archive:
+            archive.seek(offset)
+            for _ in range(end - start):
+                line = archive.readline()
+                if not line:
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"跳过损坏的归档记录: {conversation_id}")
+        return load_messages(records, os.path.getmtime(archive_path))
+
+
+class MessageDeduplicator:
+    """按消息ID过滤重连或服务端重发造成的重复消息
+
+    最近见过的 (对话ID, 消息ID) 保存在一个全局的有界LRU中，每个对话第一次检查时用
+    已保存的内存窗口填充。对话最新一条已保存消息的时间作为水位线：比水位线新的消息
+    不在LRU中即为新消息；不比水位线新、又不在LRU中的消息（例如LRU已淘汰）再通过
+    时间索引到磁盘上确认。
+    """
+
+    def __init__(self, storage, capacity=20000):
+        self.storage = storage
+        self.capacity = max(1, int(capacity))
+        self.recent = OrderedDict()
+        self.seeded = set()
+        self.suppressed = 0  # 已过滤的重复消息数量
+        self.lock = threading.Lock()
+
+    def _remember(self, conversation_id, message_id):
+        key = (conversation_id, message_id)
+        self.recent[key] = None
+        self.recent.move_to_end(key)
+        if len(self.recent) > self.capacity:
+            self.recent.popitem(last=False)
+
+    def is_duplicate(self, conv, message_id, timestamp):
+        """检查消息是否已保存过，是新消息时记录下来"""
+        if message_id is None:
+            return False
+        conversation_id = conv["id"]
+        with self.lock:
+            messages = conv.get("messages", [])
+            if conversation_id not in self.seeded:
+                self.seeded.add(conversation_id)
+                for msg in messages:
+                    if msg.message_id is not None:
+                        self._remember(conversation_id, msg.message_id)
+
+            key = (conversation_id, message_id)
+            duplicate = key in self.recent
+            if not duplicate:
+                watermark = messages[-1].timestamp if messages else None
+                if watermark is not None and timestamp <= watermark:
+                    duplicate = self.storage.find_message(conv, timestamp, message_id)[1] is not None
+
+            self._remember(conversation_id, message_id)
+            if duplicate:
+                self.suppressed += 1
+            return duplicate
+
+
+class _TimeIndex:
+    """把磁盘上的时间索引包装成只读序列，供 bisect 直接在文件上二分查找"""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        self.f.seek(i * TIME_RECORD.size)
+        return TIME_RECORD.unpack(self.f.read(TIME_RECORD.size))[0]
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+
+
+def diff_items(old, new):
+    """比较两份列表快照，返回 (新增或变化的项, 删除的键)"""
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+def _write_json(path, data):
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"保存联系人快照失败: {os.path.basename(path)}, {e}")
+
+
+class ContactCache:
+    """好友列表、群列表和群成员列表的磁盘快照
+
+    启动时直接用快照填充对话列表和群成员信息，连接后再从服务器获取并与快照比较，
+    只有新增、变化或删除的项需要更新界面。快照保存在 cache/contacts 目录中：
+
+    - ``lists.json``：账号、好友列表和群列表，以及各自最后一次变化的时间::
+
+        {"self_id": "10000",
+         "friends": {"taken_at": 1700000000.0, "items": {"20001": "昵称"}},
+         "groups": {"taken_at": 1700000000.0, "items": {"30001": "群名"}}}
+
+    - ``members/<群号>.json``：每个群一个文件，``{"taken_at": ..., "items": {QQ号: 成员信息}}``
+
+    群成员列表按群分别保存，并且只在有变化时写入，收到一个群的成员列表不会重写其他群的数据。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.members_dir = os.path.join(directory, "members")
+        self.data = {"self_id": "", "friends": {}, "groups": {}}
+        self.member_data = {}  # 群号 -> {"taken_at", "items"}
+
+    def load(self):
+        path = os.path.join(self.directory, "lists.json")
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                for key in self.data:
+                    if isinstance(data.get(key), type(self.data[key])):
+                        self.data[key] = data[key]
+            except (OSError, ValueError) as e:
+                print(f"加载联系人快照失败: {e}")
+
+        if os.path.exists(self.members_dir):
+            for filename in os.listdir(self.members_dir):
+                if not filename.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.members_dir, filename), 'r', encoding='utf-8') as f:
+                        self.member_data[filename[:-len(".json")]] = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"加载群成员快照失败: {filename}, {e}")
+
+    def _save_lists(self):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_json(os.path.join(self.directory, "lists.json"), self.data)
+
+    def _save_members(self, group_id, entry):
+        os.makedirs(self.members_dir, exist_ok=True)
+        _write_json(os.path.join(self.members_dir, f"{group_id}.json"), entry)
+
+    def items(self, kind):
+        """好友（friends）或群（groups）快照中的 {ID: 名称}"""
+        return self.data[kind].get("items", {})
+
+    def members(self):
+        """所有群的成员快照 {群号: {QQ号: 成员信息}}"""
+        return {group_id: entry.get("items", {}) for group_id, entry in self.member_data.items()}
+
+    def update(self, kind, items, self_id=""):
+        """用服务器返回的好友或群列表更新快照，返回 (新增或变化的项, 删除的键)"""
+        entry = self.data[kind]
+        changed, removed = diff_items(entry.get("items", {}), items)
+        account_changed = bool(self_id) and self.data.get("self_id") != self_id
+        if changed or removed or account_changed:
+            entry["taken_at"] = time.time()
+            entry["items"] = items
+            if self_id:
+                self.data["self_id"] = self_id
+            self._save_lists()
+        return changed, removed
+
+    def update_members(self, group_id, members):
+        """用服务器返回的群成员列表更新快照，返回 (新增或变化的项, 删除的键)"""
+        entry = self.member_data.setdefault(group_id, {})
+        changed, removed = diff_items(entry.get("items", {}), members)
+        if changed or removed:
+            entry["taken_at"] = time.time()
+            entry["items"] = members
+            self._save_members(group_id, entry)
+        return changed, removed
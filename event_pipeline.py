@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+
+class StageStats:
+    """单个处理阶段的耗时统计"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def format(self):
+        average = self.total / self.count if self.count else 0.0
+        return f"平均 {average * 1000:.1f} ms，最大 {self.max * 1000:.1f} ms（{self.count}次）"
+
+
+class EventPipeline:
+    """接收事件的分级处理管道
+
+    接收 -> 解码 -> 有界分发队列 -> 处理。API响应和元事件进入高优先级队列，总是先于
+    聊天消息处理；聊天消息进入有界的低优先级队列，队列满时按 overflow 策略处理：
+
+    - ``block``：等待队列有空位，接收循环随之暂停，对端的发送会被TCP背压阻塞
+    - ``drop_oldest``：丢弃队列中最早的一条免打扰对话的消息，没有可丢弃的消息时等待
+    - ``spill``：把新消息按顺序写入磁盘，队列消化到一半以下时再读回
+
+    免打扰对话的消息在入队时判断一次，单独放在一个队列中，丢弃最早的免打扰消息只需 O(1)；
+    两个消息队列按入队时间合并分发，处理顺序与到达顺序一致。
+
+    所有方法都在 asyncio 事件循环线程中调用。
+    """
+
+    def __init__(self, handler, maxsize=2000, overflow="block", spill_path=None, is_muted=None):
+        if overflow not in OVERFLOW_POLICIES:
+            print(f"未知的队列溢出策略: {overflow}，使用 block")
+            overflow = "block"
+        self.handler = handler
+        self.maxsize = max(1, int(maxsize))
+        self.overflow = overflow
+        self.spill_path = spill_path or os.path.join("cache", "event_spill.jsonl")
+        self.is_muted = is_muted or (lambda data: False)
+
+        self.high = deque()  # (入队时间, 事件)
+        self.low = deque()
+        self.muted = deque()  # 免打扰对话的消息
+        self._available = None
+        self._space = None
+
+        self.stages = {"decode": StageStats(), "queue": StageStats(), "dispatch": StageStats()}
+        self.counters = {"received": 0, "invalid": 0, "blocked": 0, "dropped": 0, "spilled": 0}
+
+        # 上次运行时溢出到磁盘但没处理完的事件，启动后继续处理
+        self._spill_offset = 0
+        self.spilling = os.path.exists(self.spill_path) and os.path.getsize(self.spill_path) > 0
+
+    def _ensure_primitives(self):
+        # asyncio 同步原语需要在事件循环线程中创建
+        if self._available is None:
+            self._available = asyncio.Event()
+            self._space = asyncio.Event()
+
+    @staticmethod
+    def is_priority(data):
+        """API响应和元事件（心跳、生命周期）优先处理"""
+        return "post_type" not in data or data.get("post_type") == "meta_event"
+
+    async def submit(self, raw):
+        """接收阶段：解码并放入分发队列，队列满时可能等待"""
+        self._ensure_primitives()
+        received = time.monotonic()
+        self.counters["received"] += 1
+        try:
+            data = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+        except ValueError:
+            self.counters["invalid"] += 1
+            print(f"无法解析的事件: {str(raw)[:100]}")
+            return
+        if not isinstance(data, dict):
+            self.counters["invalid"] += 1
+            return
+        decoded = time.monotonic()
+        self.stages["decode"].record(decoded - received)
+
+        if self.is_priority(data):
+            self.high.append((decoded, data))
+            self._available.set()
+            return
+        await self._put_low(decoded, data)
+
+    def queued(self):
+        """消息队列中的事件数量"""
+        return len(self.low) + len(self.muted)
+
+    def _droppable(self, data):
+        # 只有 drop_oldest 策略需要区分免打扰消息
+        return self.overflow == "drop_oldest" and self.is_muted(data)
+
+    def _append_low(self, enqueued, data, muted=None):
+        if muted is None:
+            muted = self._droppable(data)
+        (self.muted if muted else self.low).append((enqueued, data))
+
+    async def _put_low(self, enqueued, data):
+        # 已有事件溢出到磁盘时，新事件也写入磁盘，保证处理顺序
+        if self.spilling:
+            self._spill(data)
+            return
+
+        muted = self._droppable(data)
+        while self.queued() >= self.maxsize:
+            if self.overflow == "spill":
+                self._spill(data)
+                return
+            if self.overflow == "drop_oldest":
+                if self.muted:
+                    self.muted.popleft()
+                    self.counters["dropped"] += 1
+                    continue
+                if muted:
+                    self.counters["dropped"] += 1
+                    return
+            # 没有可丢弃的免打扰消息，直接等待
+            self.counters["blocked"] += 1
+            self._space.clear()
+            await self._space.wait()
+
+        self._append_low(enqueued, data, muted)
+        self._available.set()
+
+    def _spill(self, data):
+        directory = os.path.dirname(self.spill_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps([time.time(), data], ensure_ascii=False) + "\n")
+        self.spilling = True
+        self.counters["spilled"] += 1
+        self._available.set()
+
+    def _load_spilled(self):
+        """从磁盘读回一批溢出的事件，全部读完后删除溢出文件"""
+        count = 0
+        limit = max(1, self.maxsize // 2)
+        now_wall, now = time.time(), time.monotonic()
+        with open(self.spill_path, 'r', encoding='utf-8') as f:
+            f.seek(self._spill_offset)
+            while count < limit:
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    spilled_at, data = json.loads(line)
+                except ValueError:
+                    continue
+                # 把写入磁盘的时间换算为 monotonic 时间，排队时长包含在磁盘上等待的时间
+                self._append_low(now - max(0.0, now_wall - spilled_at), data)
+                count += 1
+            self._spill_offset = f.tell()
+            finished = not f.readline()
+        if finished:
+            os.remove(self.spill_path)
+            self._spill_offset = 0
+            self.spilling = False
+        return count
+
+    async def run(self):
+        """分发阶段：优先处理高优先级队列，每处理一个事件让出一次事件循环"""
+        self._ensure_primitives()
+        while True:
+            if self.spilling and self.queued() < self.maxsize // 2:
+                self._load_spilled()
+
+            if self.high:
+                queue = self.high
+            elif self.low and (not self.muted or self.low[0][0] <= self.muted[0][0]):
+                queue = self.low
+            elif self.muted:
+                queue = self.muted
+            else:
+                self._available.clear()
+                await self._available.wait()
+                continue
+
+            enqueued, data = queue.popleft()
+            if queue is not self.high and self.queued() < self.maxsize:
+                self._space.set()
+
+            started = time.monotonic()
+            self.stages["queue"].record(started - enqueued)
+            try:
+                self.handler(data)
+            except Exception as e:
+                print(f"处理事件失败: {e}")
+            self.stages["dispatch"].record(time.monotonic() - started)
+            await asyncio.sleep(0)
+
+    def current_lag(self):
+        """队列中最早的事件已等待的时间"""
+        oldest = [queue[0][0] for queue in (self.high, self.low, self.muted) if queue]
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    def format_metrics(self):
+        lines = [
+            f"高优先级队列: {len(self.high)}，消息队列: {self.queued()}/{self.maxsize}"
+            f"（其中免打扰 {len(self.muted)}，溢出策略: {self.overflow}）",
+            f"当前排队延迟: {self.current_lag() * 1000:.1f} ms",
+            f"解码: {self.stages['decode'].format()}",
+            f"排队: {self.stages['queue'].format()}",
+            f"处理: {self.stages['dispatch'].format()}",
+            "接收 {received}，无效 {invalid}，等待 {blocked}，丢弃 {dropped}，溢出到磁盘 {spilled}".format(**self.counters)
+        ]
+        if self.spilling:
+            lines.append("磁盘上还有未处理的溢出事件")
+        return "\n".join(lines)
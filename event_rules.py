@@ -0,0 +1,126 @@
+import re
+
+# 规则动作
+NORMAL = "normal"  # 正常处理
+ARCHIVE = "archive"  # 只保存聊天记录，不更新界面
+DROP = "drop"  # 直接丢弃
+ACTIONS = (NORMAL, ARCHIVE, DROP)
+
+CQ_TYPE_PATTERN = re.compile(r'\[CQ:(\w+)')
+
+
+def _id_set(value):
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple, set)):
+        value = [value]
+    return frozenset(str(v) for v in value)
+
+
+class Rule:
+    __slots__ = ("groups", "users", "keyword", "segments", "action")
+
+    def __init__(self, groups, users, keyword, segments, action):
+        self.groups = groups
+        self.users = users
+        self.keyword = keyword
+        self.segments = segments
+        self.action = action
+
+    def matches(self, data, user_id, segment_types):
+        # 群号已经在候选规则列表中筛选过，这里只检查其余条件，开销小的条件在前
+        if self.users is not None and user_id not in self.users:
+            return False
+        if self.segments is not None and not (self.segments & segment_types()):
+            return False
+        if self.keyword is not None and not self.keyword.search(data.get("raw_message", "")):
+            return False
+        return True
+
+
+class EventRules:
+    """消息事件过滤规则
+
+    规则写在 config.json 的 ``rules`` 中，按顺序匹配，第一条匹配的规则决定动作::
+
+        "rules": [
+            {"group": 123456, "action": "archive"},
+            {"user": [10001, 10002], "action": "drop"},
+            {"keyword": "广告|推广", "action": "drop"},
+            {"group": 654321, "segment": "image", "action": "drop"}
+        ]
+
+    条件可以是 ``group``（群号）、``user``（QQ号）、``keyword``（正则表达式，匹配原始消息）
+    和 ``segment``（消息段类型，如 image、record、face），多个条件需要同时满足。
+    规则在加载时编译：正则预先编译，并按群号预先算好每个群需要检查的规则列表，
+    匹配时只需一次字典查找和少量集合判断。
+    """
+
+    def __init__(self, rules=None):
+        self.counters = {action: 0 for action in ACTIONS}
+        self._by_group = {}  # 群号 -> 该群消息需要检查的规则（按原顺序）
+        self._ungrouped = ()  # 规则中未出现的群和私聊消息需要检查的规则（不限群号的规则）
+        self.compile(rules or [])
+
+    def compile(self, rules):
+        compiled = []
+        for index, spec in enumerate(rules):
+            action = spec.get("action", NORMAL)
+            if action not in ACTIONS:
+                print(f"规则{index + 1}的动作无效: {action}，已忽略")
+                continue
+            try:
+                keyword = re.compile(spec["keyword"]) if spec.get("keyword") else None
+            except re.error as e:
+                print(f"规则{index + 1}的正则表达式无效: {e}，已忽略")
+                continue
+            compiled.append(Rule(
+                _id_set(spec.get("group")),
+                _id_set(spec.get("user")),
+                keyword,
+                _id_set(spec.get("segment")),
+                action
+            ))
+
+        self.rules = compiled
+        self._ungrouped = tuple(r for r in compiled if r.groups is None)
+        group_ids = set()
+        for rule in compiled:
+            if rule.groups is not None:
+                group_ids.update(rule.groups)
+        self._by_group = {
+            group_id: tuple(r for r in compiled if r.groups is None or group_id in r.groups)
+            for group_id in group_ids
+        }
+
+    def evaluate(self, data, record=True):
+        """返回消息事件应执行的动作，record 为 False 时不计入统计"""
+        if not self.rules or "message_type" not in data:
+            return NORMAL
+
+        if data.get("message_type") == "group":
+            candidates = self._by_group.get(str(data.get("group_id")), self._ungrouped)
+        else:
+            candidates = self._ungrouped
+        if not candidates:
+            return NORMAL
+
+        user_id = str(data.get("user_id"))
+        types = []
+
+        def segment_types():
+            # 只有规则需要时才解析消息段类型
+            if not types:
+                message = data.get("message")
+                if isinstance(message, list):
+                    types.append(frozenset(seg.get("type") for seg in message if isinstance(seg, dict)))
+                else:
+                    types.append(frozenset(CQ_TYPE_PATTERN.findall(data.get("raw_message", ""))))
+            return types[0]
+
+        for rule in candidates:
+            if rule.matches(data, user_id, segment_types):
+                if record:
+                    self.counters[rule.action] += 1
+                return rule.action
+        return NORMAL
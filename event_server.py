@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import hmac
+import inspect
+import json
+import urllib.parse
+
+
+def check_access_token(access_token, headers, query=""):
+    """校验 OneBot11 访问令牌：``Authorization: Bearer <token>`` 请求头或 ``access_token`` 查询参数"""
+    if not access_token:
+        return True
+    authorization = headers.get("Authorization", "")
+    for prefix in ("Bearer ", "Token "):
+        if authorization.startswith(prefix) and hmac.compare_digest(authorization[len(prefix):], access_token):
+            return True
+    token = urllib.parse.parse_qs(query).get("access_token", [""])[0]
+    return bool(token) and hmac.compare_digest(token, access_token)
+
+
+def check_signature(secret, body, signature):
+    """校验 HTTP POST 上报的 ``X-Signature: sha1=<HMAC-SHA1(secret, body)>``"""
+    if not secret:
+        return True
+    expected = "sha1=" + hmac.new(secret.encode(), body, hashlib.sha1).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+
+async def deliver(on_message, message):
+    """把收到的数据交给回调处理，回调是协程时等待其完成（用于接收队列的背压）"""
+    result = on_message(message)
+    if inspect.isawaitable(result):
+        await result
+
+
+class ReverseWebSocketServer:
+    """反向WebSocket服务端：由OneBot实现主动连接到本客户端
+
+    可以同时接受多个机器人实例的连接，收到的数据都交给 on_message 处理。
+    角色为 Universal 或 API 的连接会通过 on_connect/on_disconnect 通知，用于发送API请求。
+    """
+
+    def __init__(self, host, port, access_token, on_message, on_connect=None, on_disconnect=None):
+        self.host = host
+        self.port = port
+        self.access_token = access_token
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.connections = {}  # self_id -> websocket
+        self.server = None
+
+    async def start(self):
+        import websockets
+        self.server = await websockets.serve(self.handler, self.host, self.port, process_request=self.process_request)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        self.connections.clear()
+
+    async def process_request(self, path, request_headers):
+        # 握手阶段校验令牌，失败时直接返回 401，不建立连接
+        query = urllib.parse.urlsplit(path).query
+        if not check_access_token(self.access_token, request_headers, query):
+            print(f"反向WebSocket连接鉴权失败: {path}")
+            return 401, [], b"Unauthorized\n"
+        return None
+
+    async def handler(self, websocket):
+        self_id = websocket.request_headers.get("X-Self-ID", "")
+        role = websocket.request_headers.get("X-Client-Role", "Universal")
+        can_call_api = role in ("Universal", "API")
+        print(f"机器人已连接: self_id={self_id}, role={role}")
+        if can_call_api:
+            self.connections[self_id] = websocket
+            if self.on_connect:
+                self.on_connect(self_id, websocket)
+        try:
+            async for message in websocket:
+                await deliver(self.on_message, message)
+        except Exception as e:
+            print(f"反向WebSocket连接异常: {e}")
+        finally:
+            print(f"机器人已断开: self_id={self_id}")
+            if can_call_api and self.connections.get(self_id) is websocket:
+                del self.connections[self_id]
+                if self.on_disconnect:
+                    self.on_disconnect(self_id, websocket)
+
+
+class HttpPostServer:
+    """HTTP POST 事件上报服务端
+
+    基于 asyncio 的最小 HTTP/1.1 服务器，只处理 POST 上报，校验签名后把请求体交给
+    on_message 处理，并返回 204。OneBot11 的上报请求只带 ``X-Self-ID`` 和 ``X-Signature``，
+    不带访问令牌，因此这里只用 secret 校验签名，访问令牌只用于调用API。
+
+    停止时会关闭所有 keep-alive 连接，之后收到的上报不再交给 on_message。
+    """
+
+    def __init__(self, host, port, secret, on_message):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.on_message = on_message
+        self.server = None
+        self.writers = set()  # 当前打开的连接
+        self.stopping = False
+
+    async def start(self):
+        self.stopping = False
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+
+    async def stop(self):
+        if self.server:
+            self.stopping = True
+            self.server.close()
+            # server.close() 不会关闭已建立的连接，keep-alive 连接需要单独关闭
+            for writer in list(self.writers):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_connection(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            # 支持 keep-alive，同一连接上可以连续上报多个事件
+            while not self.stopping:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().title()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("Content-Length", 0) or 0))
+                keep_alive = headers.get("Connection", "").lower() != "close" and not self.stopping
+                status = await self.handle_request(method, target, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            if not self.stopping:
+                print(f"HTTP上报连接异常: {e}")
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def handle_request(self, method, target, headers, body):
+        if method != "POST":
+            return "405 Method Not Allowed"
+        if self.stopping:
+            return "503 Service Unavailable"
+        if not check_signature(self.secret, body, headers.get("X-Signature")):
+            print("HTTP上报签名校验失败")
+            return "403 Forbidden"
+        await deliver(self.on_message, body.decode('utf-8'))
+        return "204 No Content"
+
+
+class HttpApiClient:
+    """通过 OneBot11 HTTP API 调用接口
+
+    提供与 WebSocket 连接相同的 ``send`` 方法，API返回结果交给 on_message 处理，
+    使 HTTP POST 模式下也能复用原有的API调用和响应处理流程。
+    """
+
+    def __init__(self, api_url, access_token, on_message):
+        self.api_url = api_url.rstrip("/")
+        self.access_token = access_token
+        self.on_message = on_message
+
+    async def send(self, message):
+        action = json.loads(message)
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, self._post, action["action"], action.get("params", {}))
+        if "echo" in action:
+            data = json.loads(response)
+            data["echo"] = action["echo"]
+            response = json.dumps(data)
+        await deliver(self.on_message, response)
+
+    def _post(self, action, params):
+        # 只有 HTTP 模式会用到，避免在启动时导入
+        import urllib.request
+
+        request = urllib.request.Request(
+            f"{self.api_url}/{action}",
+            data=json.dumps(params).encode('utf-8'),
+            headers={"Content-Type": "application/json"}
+        )
+        if self.access_token:
+            request.add_header("Authorization", f"Bearer {self.access_token}")
+        with urllib.request.urlopen(request, timeout=15) as response:
+            return response.read().decode('utf-8')
+
+    async def close(self):
+        pass
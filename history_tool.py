@@ -0,0 +1,188 @@
+"""聊天记录批量导出/导入工具
+
+导出文件是 gzip 压缩的 JSON Lines，按对话分段，全程流式读写，内存占用与记录总量无关::
+
+    {"type": "export", "version": 1, "exported_at": 1700000000}
+    {"type": "conversation", "id": "group_123", "name": "测试群", "avatar": "👥"}
+    {"type": "message", "message_id": 1, "timestamp": 1700000000, "sender_id": "10001", ...}
+    ...
+
+导入时把文件中的消息与已有记录按时间合并，消息ID相同的消息只保留一条，
+重复导入同一个文件不会产生重复消息。导入前请先关闭客户端。
+
+用法示例：
+    python history_tool.py export backup.jsonl.gz
+    python history_tool.py export group.jsonl.gz --conversation group_123 --since 2024-01-01 --until 2024-01-31
+    python history_tool.py import backup.jsonl.gz
+"""
+import argparse
+import datetime
+import gzip
+import heapq
+import json
+import os
+import time
+from collections import OrderedDict
+
+from chat_storage import ChatMessage, ChatStorage
+from search_index import SearchIndex
+
+FORMAT_VERSION = 1
+# 合并时记住的最近消息ID数量，用于去重
+RECENT_IDS = 50000
+
+
+def parse_time(value, end=False):
+    """解析 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS；只有日期的结束时间包含当天"""
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            moment = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end and fmt == "%Y-%m-%d":
+            moment += datetime.timedelta(days=1)
+        return int(moment.timestamp())
+    raise argparse.ArgumentTypeError(f"无效的时间: {value}")
+
+
+def message_key(msg):
+    """去重使用的键：有消息ID时使用消息ID，否则使用时间、发送者和内容"""
+    if msg.message_id is not None:
+        return str(msg.message_id)
+    return (msg.timestamp, msg.sender_id, msg.content)
+
+
+def merge_messages(existing, incoming, stats):
+    """合并两个按时间排序的消息流，跳过重复的消息（时间相同时已有的消息在前）"""
+    recent = OrderedDict()
+    for msg in heapq.merge(existing, incoming, key=lambda m: m.timestamp):
+        key = message_key(msg)
+        if key in recent:
+            stats["duplicates"] += 1
+            continue
+        recent[key] = None
+        if len(recent) > RECENT_IDS:
+            recent.popitem(last=False)
+        yield msg
+
+
+class ExportReader:
+    """按对话读取导出文件：迭代得到 (对话信息, 消息迭代器)
+
+    消息迭代器与文件共用读取位置，读取下一个对话前没有读完的消息会被跳过。
+    """
+
+    def __init__(self, f):
+        self.records = (json.loads(line) for line in f if line.strip())
+        self.current = next(self.records, None)
+        if self.current is not None and self.current.get("type") == "export":
+            if self.current.get("version", 0) > FORMAT_VERSION:
+                raise ValueError(f"不支持的导出文件版本: {self.current.get('version')}")
+            self.current = next(self.records, None)
+
+    def __iter__(self):
+        while self.current is not None:
+            record = self.current
+            self.current = next(self.records, None)
+            if record.get("type") == "conversation":
+                yield record, self._messages()
+
+    def _messages(self):
+        while self.current is not None and self.current.get("type") == "message":
+            record = self.current
+            self.current = next(self.records, None)
+            yield ChatMessage.from_dict(record)
+
+
+def export_history(storage, path, conversation_ids=None, start_time=None, end_time=None):
+    stats = {"conversations": 0, "messages": 0}
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({"type": "export", "version": FORMAT_VERSION, "exported_at": int(time.time())}) + "\n")
+        for conv in storage.iter_all():
+            if conversation_ids and conv["id"] not in conversation_ids:
+                continue
+            header = {"type": "conversation", "id": conv["id"], "name": conv.get("name", conv["id"]),
+                      "avatar": conv.get("avatar", "👤")}
+            f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n")
+            stats["conversations"] += 1
+            for msg in storage.iter_messages(conv, start_time, end_time):
+                record = msg.to_dict()
+                record["type"] = "message"
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                stats["messages"] += 1
+    return stats
+
+
+def import_history(storage, path, conversation_ids=None, start_time=None, end_time=None):
+    stats = {"conversations": 0, "messages": 0, "imported": 0, "duplicates": 0}
+
+    def incoming(messages):
+        for msg in messages:
+            stats["messages"] += 1
+            if start_time is not None and msg.timestamp < start_time:
+                continue
+            if end_time is not None and msg.timestamp >= end_time:
+                continue
+            yield msg
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for header, messages in ExportReader(f):
+            cid = header["id"]
+            if conversation_ids and cid not in conversation_ids:
+                continue
+            conv = storage.load(cid)
+            if conv is None:
+                conv = {"id": cid, "name": header.get("name", cid), "avatar": header.get("avatar", "👤"), "messages": []}
+            before = storage.total_count(conv)
+            merged = merge_messages(storage.iter_messages(conv), incoming(messages), stats)
+            total = storage.rewrite(conv, merged)
+            stats["conversations"] += 1
+            stats["imported"] += total - before
+            print(f"  {cid}: 新增 {total - before} 条，共 {total} 条")
+    return stats
+
+
+def report(action, stats, path, elapsed):
+    size = os.path.getsize(path)
+    elapsed = max(elapsed, 1e-6)
+    print(f"{action}完成: {stats['conversations']} 个对话，{stats['messages']} 条消息，用时 {elapsed:.2f} 秒")
+    print(f"吞吐量: {stats['messages'] / elapsed:.0f} 条/秒，{size / elapsed / 1024 / 1024:.2f} MB/秒（文件 {size / 1024 / 1024:.2f} MB）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天记录批量导出/导入")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("file", help="导出文件路径（.jsonl.gz）")
+    parser.add_argument("--history-dir", default="chat_history", help="聊天记录目录")
+    parser.add_argument("--index-dir", default="search_index", help="搜索索引目录，导入后下次启动时重建")
+    parser.add_argument("--conversation", action="append", help="只处理指定的对话ID，可以重复指定")
+    parser.add_argument("--since", type=parse_time, help="开始时间（包含），YYYY-MM-DD [HH:MM:SS]")
+    parser.add_argument("--until", type=lambda v: parse_time(v, end=True), help="结束时间（不包含），只写日期时包含当天")
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists("config.json"):
+        with open("config.json", 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    storage = ChatStorage(
+        args.history_dir,
+        window_messages=config.get("history_window_messages", 200),
+        window_bytes=config.get("history_window_bytes", 256 * 1024)
+    )
+    conversation_ids = set(args.conversation) if args.conversation else None
+
+    started = time.monotonic()
+    if args.action == "export":
+        stats = export_history(storage, args.file, conversation_ids, args.since, args.until)
+        report("导出", stats, args.file, time.monotonic() - started)
+    else:
+        stats = import_history(storage, args.file, conversation_ids, args.since, args.until)
+        report("导入", stats, args.file, time.monotonic() - started)
+        print(f"新增 {stats['imported']} 条消息，跳过重复消息 {stats['duplicates']} 条")
+        if stats["imported"]:
+            SearchIndex(args.index_dir).invalidate()
+            print("搜索索引将在下次启动客户端时重建")
+
+
+if __name__ == "__main__":
+    main()
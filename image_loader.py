@@ -0,0 +1,459 @@
+import hashlib
+import html
+import io
+import os
+import re
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+
+IMAGE_PATTERN = re.compile(r'\[CQ:image,file=(.*?),url=(.*?)\]')
+
+# 还不知道尺寸的图片使用的占位大小
+DEFAULT_PLACEHOLDER_SIZE = (200, 150)
+# 动图最多保留的帧数，超出时均匀抽帧并合并帧时长
+MAX_FRAMES = 120
+# 帧时长过短（很多GIF写的是0或10毫秒）时按浏览器的惯例使用100毫秒
+MIN_FRAME_DURATION = 20
+DEFAULT_FRAME_DURATION = 100
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/webp,*/*',
+    'Accept-Language': 'zh-CN,zh;q=0.9',
+    'Referer': 'https://im.qq.com/',  # 添加QQ相关引用来源
+    'Connection': 'keep-alive',
+    'Pragma': 'no-cache',
+    'Cache-Control': 'no-cache'
+}
+
+
+class ImageUnavailable(Exception):
+    """图片无法获取，界面上显示异常信息中的文本代替图片"""
+
+
+class AnimatedImage:
+    """缩放好的动图帧，同一张动图的所有显示位置共用
+
+    帧在工作线程中一次解码缩放完成；PhotoImage 在Tk线程中第一次播放到该帧时才创建，
+    创建后释放对应的PIL帧。
+    """
+
+    __slots__ = ("frames", "durations", "size", "photos")
+
+    def __init__(self, frames, durations):
+        self.frames = frames
+        self.durations = durations  # 毫秒
+        self.size = frames[0].size
+        self.photos = [None] * len(frames)
+
+    def __len__(self):
+        return len(self.photos)
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    @property
+    def nbytes(self):
+        return self.size[0] * self.size[1] * 4 * len(self.photos)
+
+    def photo(self, index):
+        """Tk线程：第 index 帧的 PhotoImage"""
+        photo = self.photos[index]
+        if photo is None:
+            from PIL import ImageTk
+            photo = self.photos[index] = ImageTk.PhotoImage(self.frames[index])
+            self.frames[index] = None
+        return photo
+
+
+def normalize_image_url(image_url):
+    """清理CQ码中的图片URL：解码HTML实体和URL编码，去掉 file_size 参数，补全协议"""
+    image_url = html.unescape(image_url.strip()).replace('&amp;', '&')
+
+    if '%' in image_url:
+        try:
+            image_url = urllib.parse.unquote(image_url)
+        except Exception as e:
+            print(f"URL解码失败: {e}")
+
+    # 处理特殊格式的URL，如QQ图片URL末尾的file_size参数
+    if ',file_size=' in image_url:
+        image_url = image_url.split(',file_size=')[0]
+
+    if not image_url.startswith(('http://', 'https://', 'file:///')):
+        if image_url.startswith('//'):
+            image_url = 'https:' + image_url
+        elif '.' in image_url and ('/' in image_url or '\\' in image_url):
+            # 可能是相对路径或不完整URL，尝试添加https协议
+            image_url = 'https://' + image_url
+    return image_url
+
+
+def image_urls(content):
+    """消息内容中所有图片的URL（已清理）"""
+    return [normalize_image_url(url) for _, url in IMAGE_PATTERN.findall(content)]
+
+
+class ImageLoader:
+    """后台图片加载器
+
+    下载、解码和缩放都在工作线程中完成，Tk线程只负责把缩放好的图片转换为 PhotoImage。
+    请求分两级：
+
+    - 可见图片（``request``）：由专用线程处理，预取线程空闲时也会优先处理
+    - 预取图片（``prefetch``）：不在查看的对话中收到的图片，只由一个预取线程处理，
+      队列有上限，先处理最新收到的图片，解码结果放在内存缓存中，打开对话时直接显示
+
+    动图（GIF/WebP）会解码出全部帧，回调收到的是 ``AnimatedImage``，由 ``AnimationPlayer`` 播放。
+    下载的图片保存在 cache/pictures 中，内存缓存按解码后的字节数限制大小。
+    除 ``prefetch`` 外的方法都只能在Tk线程中调用。
+    """
+
+    def __init__(self, root, cache_dir, max_size=(300, 300), workers=2,
+                 prefetch_limit=200, cache_bytes=32 * 1024 * 1024):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.workers = max(1, int(workers))
+        self.cache_bytes = cache_bytes
+
+        self.condition = threading.Condition()
+        self.visible = deque()
+        self.prefetching = deque(maxlen=prefetch_limit)  # 超出上限时丢弃最早的预取请求
+        self.loading = set()
+        self.pending = {}  # url -> 等待图片的回调列表
+        self.decoded = OrderedDict()  # url -> 缩放后的PIL图片（LRU）
+        self.decoded_bytes = 0
+        self.sizes = OrderedDict()  # url -> (宽, 高)，用于预先确定占位大小
+        self.photos = OrderedDict()  # url -> PhotoImage 或 AnimatedImage，只在Tk线程中访问
+        self.photo_bytes = 0
+        self.counters = {"prefetched": 0, "loaded": 0, "failed": 0, "cache_hits": 0}
+        self.started = False
+
+    def _ensure_workers(self):
+        # 第一次需要加载图片时才启动线程
+        if self.started:
+            return
+        self.started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, args=(False,), daemon=True).start()
+        threading.Thread(target=self._worker, args=(True,), daemon=True).start()
+
+    def size_hint(self, url):
+        """图片显示时的大小；还没有加载过的图片返回默认占位大小"""
+        with self.condition:
+            return self.sizes.get(url, DEFAULT_PLACEHOLDER_SIZE)
+
+    def request(self, url, callback):
+        """加载要显示的图片，完成后在Tk线程中调用 callback(image, error)
+
+        image 是 PhotoImage 或 AnimatedImage，加载失败时为 None。
+        """
+        photo = self.photos.get(url)
+        if photo is not None:
+            self.photos.move_to_end(url)
+            self.counters["cache_hits"] += 1
+            callback(photo, None)
+            return
+
+        with self.condition:
+            image = self.decoded.get(url)
+            if image is None:
+                self.pending.setdefault(url, []).append(callback)
+                # 正在加载的图片完成后会通知等待的回调，不需要重复加入队列
+                if url not in self.loading:
+                    self.visible.append(url)
+                    self._ensure_workers()
+                    self.condition.notify_all()
+                return
+        self.counters["cache_hits"] += 1
+        callback(self._make_photo(url, image), None)
+
+    def prefetch(self, url):
+        """低优先级预取图片（可在任意线程中调用）"""
+        with self.condition:
+            if self._done(url) or url in self.pending:
+                return
+            self.prefetching.append(url)
+            self._ensure_workers()
+            self.condition.notify()
+
+    def _done(self, url):
+        # 已解码、正在加载或已转换为 PhotoImage 的图片不需要再加载（只读检查 photos）
+        return url in self.decoded or url in self.loading or url in self.photos
+
+    def _next(self, allow_prefetch):
+        while self.visible:
+            url = self.visible.popleft()
+            if not self._done(url):
+                return url
+        while allow_prefetch and self.prefetching:
+            url = self.prefetching.pop()
+            if not self._done(url):
+                return url
+        return None
+
+    def _worker(self, allow_prefetch):
+        while True:
+            with self.condition:
+                url = self._next(allow_prefetch)
+                while url is None:
+                    self.condition.wait()
+                    url = self._next(allow_prefetch)
+                self.loading.add(url)
+                visible = url in self.pending
+
+            image, error = None, None
+            try:
+                image = self._decode(url)
+            except Exception as e:
+                error = e
+                if not isinstance(e, ImageUnavailable):
+                    print(f"加载图片失败: {e}, URL: {url}")
+
+            with self.condition:
+                self.loading.discard(url)
+                if image is not None:
+                    self._remember(url, image)
+                    self.counters["loaded" if visible else "prefetched"] += 1
+                else:
+                    self.counters["failed"] += 1
+                waiting = url in self.pending
+            if waiting:
+                self.root.after(0, self._deliver, url, error)
+
+    def _remember(self, url, image):
+        # 调用时已持有锁
+        self.decoded[url] = image
+        self.decoded_bytes += self._image_bytes(image)
+        self.sizes[url] = image.size
+        while self.decoded_bytes > self.cache_bytes and len(self.decoded) > 1:
+            _, evicted = self.decoded.popitem(last=False)
+            self.decoded_bytes -= self._image_bytes(evicted)
+        while len(self.sizes) > 10000:
+            self.sizes.popitem(last=False)
+
+    @staticmethod
+    def _image_bytes(image):
+        if isinstance(image, AnimatedImage):
+            return image.nbytes
+        return image.width * image.height * len(image.getbands())
+
+    @staticmethod
+    def _photo_bytes(photo):
+        if isinstance(photo, AnimatedImage):
+            return photo.nbytes
+        return photo.width() * photo.height() * 4
+
+    def _deliver(self, url, error):
+        """Tk线程：把加载结果交给等待的回调"""
+        photo = self.photos.get(url)
+        with self.condition:
+            image = self.decoded.get(url)
+            if photo is None and image is None and error is None:
+                # 还没来得及显示就被挤出了缓存，重新加载
+                self.visible.append(url)
+                self.condition.notify_all()
+                return
+            callbacks = self.pending.pop(url, [])
+        if photo is None and image is not None:
+            # request() 可能已经把解码结果转换为 PhotoImage，此时直接使用缓存
+            photo = self._make_photo(url, image)
+        for callback in callbacks:
+            try:
+                callback(photo, error)
+            except Exception as e:
+                print(f"显示图片失败: {e}")
+
+    def _make_photo(self, url, image):
+        """Tk线程：创建 PhotoImage，之后只缓存 PhotoImage，释放解码的图片"""
+        photo = self.photos.get(url)
+        if photo is None:
+            if isinstance(image, AnimatedImage):
+                photo = image
+            else:
+                from PIL import ImageTk
+                photo = ImageTk.PhotoImage(image)
+            self.photos[url] = photo
+            self.photo_bytes += self._photo_bytes(photo)
+            # PhotoImage 必须在Tk线程中释放，所以只在这里淘汰；正在显示的图片由标签引用，不受影响
+            while self.photo_bytes > self.cache_bytes and len(self.photos) > 1:
+                _, evicted = self.photos.popitem(last=False)
+                self.photo_bytes -= self._photo_bytes(evicted)
+        with self.condition:
+            if self.decoded.pop(url, None) is not None:
+                self.decoded_bytes -= self._image_bytes(image)
+        return photo
+
+    def _decode(self, url):
+        """工作线程：获取图片并缩放为显示大小"""
+        # 图片相关的库较大，第一次加载图片时才导入
+        from PIL import Image
+        image = Image.open(self._fetch(url))
+        if getattr(image, "n_frames", 1) > 1:
+            return self._decode_frames(image)
+        # 对JPEG会先按比例降采样解码，再缩放
+        image.thumbnail(self.max_size, Image.Resampling.LANCZOS)
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        return image
+
+    def _decode_frames(self, image):
+        """工作线程：解码动图的全部帧，缩放到同一大小"""
+        from PIL import Image, ImageSequence
+        width, height = image.size
+        scale = min(1.0, self.max_size[0] / width, self.max_size[1] / height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        # 帧数太多时均匀抽帧，被跳过的帧的时长加到前一帧上，总播放时长不变
+        step = -(-image.n_frames // MAX_FRAMES)
+
+        frames, durations = [], []
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            duration = frame.info.get("duration") or 0
+            if duration < MIN_FRAME_DURATION:
+                duration = DEFAULT_FRAME_DURATION
+            if index % step:
+                durations[-1] += duration
+                continue
+            frame = frame.convert("RGBA")
+            if frame.size != size:
+                frame = frame.resize(size, Image.Resampling.LANCZOS)
+            frames.append(frame)
+            durations.append(duration)
+        return AnimatedImage(frames, durations)
+
+    def _fetch(self, url):
+        """返回可以交给 Image.open 的本地路径或数据"""
+        if url.startswith("file:///"):
+            file_path = url[8:]  # 移除 'file:///'
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"本地图片文件不存在: {file_path}")
+            return file_path
+
+        # 对于OneBot协议，file参数可能是本地文件ID而不是URL，无法直接下载
+        if "file=" in url and ",url=" in url:
+            file_match = re.search(r'file=([^,]+)', url)
+            if file_match:
+                raise ImageUnavailable(f"[图片: {file_match.group(1)[:10]}...]")
+
+        # 使用URL的哈希值作为文件名缓存到本地
+        file_path = os.path.join(self.cache_dir, f"{hashlib.md5(url.encode()).hexdigest()}.jpg")
+        if os.path.exists(file_path):
+            return file_path
+
+        import requests
+        headers = HEADERS.copy()
+        if 'qq.com' in url:
+            # 增强HTTP请求头以尝试绕过QQ图片的限制
+            headers['Origin'] = 'https://im.qq.com'
+        try:
+            response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if content_type and not content_type.startswith('image/'):
+                raise ValueError(f"不是有效的图片格式: {content_type}")
+        except Exception as e:
+            print(f"下载图片失败: {e}")
+            raise ImageUnavailable(f"[图片URL: {url[:30]}...]")
+
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(temp_path, file_path)
+        except OSError as e:
+            print(f"保存图片缓存失败: {e}")
+        return io.BytesIO(response.content)
+
+
+class AnimationPlayer:
+    """所有动图共用的帧调度器
+
+    只有一个Tk定时器，每次触发时推进所有到期的动图帧，然后按最早到期的帧设置下一次触发。
+    只播放在聊天区域可见范围内的动图：滚动后调用 ``schedule_refresh`` 重新计算可见性，
+    滚出可见范围的动图停在当前帧；切换对话后原对话的标签被销毁，会自动移除。
+    没有可见的动图或窗口最小化时不再触发定时器。
+    """
+
+    def __init__(self, root, is_visible):
+        self.root = root
+        self.is_visible = is_visible
+        self.entries = {}  # 标签路径 -> [标签, AnimatedImage, 当前帧, 下一帧时间]
+        self.playing = set()
+        self.timer = None
+        self.refresh_pending = False
+
+    def add(self, label, animation):
+        self.entries[str(label)] = [label, animation, 0, 0.0]
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        # 滚动时会连续触发，合并到空闲时处理一次
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.root.after_idle(self.refresh)
+
+    def refresh(self):
+        """重新计算哪些动图在可见范围内"""
+        self.refresh_pending = False
+        now = time.monotonic()
+        for key, entry in list(self.entries.items()):
+            label, animation, index, _ = entry
+            if not label.winfo_exists():
+                del self.entries[key]
+                self.playing.discard(key)
+            elif self.is_visible(label):
+                if key not in self.playing:
+                    # 从当前帧继续播放
+                    entry[3] = now + animation.durations[index] / 1000
+                    self.playing.add(key)
+            else:
+                self.playing.discard(key)
+        self._schedule()
+
+    def _schedule(self):
+        if self.timer is not None:
+            self.root.after_cancel(self.timer)
+            self.timer = None
+        if not self.playing:
+            return
+        due = min(self.entries[key][3] for key in self.playing)
+        delay = max(MIN_FRAME_DURATION, int((due - time.monotonic()) * 1000))
+        self.timer = self.root.after(delay, self._tick)
+
+    def _tick(self):
+        self.timer = None
+        if self.root.state() == "iconic":
+            # 窗口最小化时暂停，恢复后由 <Map> 事件或滚动重新开始
+            self.playing.clear()
+            return
+
+        now = time.monotonic()
+        for key in list(self.playing):
+            entry = self.entries[key]
+            label, animation, index, due = entry
+            if due > now:
+                continue
+            if not label.winfo_exists():
+                del self.entries[key]
+                self.playing.discard(key)
+                continue
+            index = (index + 1) % len(animation)
+            photo = animation.photo(index)
+            label.configure(image=photo)
+            label.image = photo
+            due += animation.durations[index] / 1000
+            # 落后太多（例如界面卡顿）时不追帧
+            entry[2], entry[3] = index, max(due, now)
+        self._schedule()
+
+    def format_metrics(self):
+        return f"动图: 播放中 {len(self.playing)}，已显示 {len(self.entries)}"
@@ -0,0 +1,158 @@
+"""本地模拟的OneBot11实现，用于在没有真实机器人时测试客户端
+
+- ``forward``：启动WebSocket服务端，客户端以正向WebSocket方式连接
+- ``reverse``：主动连接客户端的反向WebSocket服务
+- ``http``：向客户端的HTTP POST上报地址发送事件（带签名）
+
+三种方式都会定时发送模拟的私聊/群聊消息，WebSocket方式还会响应常用的API请求。
+
+用法示例：
+    python mock_onebot.py reverse ws://127.0.0.1:8081 --token abc
+    python mock_onebot.py http http://127.0.0.1:8081 --secret s3cret --count 100
+    python mock_onebot.py forward ws://127.0.0.1:8080
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import time
+import urllib.parse
+import urllib.request
+
+SELF_ID = 10000
+FRIENDS = [{"user_id": 20000 + i, "nickname": f"好友{i}", "remark": ""} for i in range(20)]
+GROUPS = [{"group_id": 30000 + i, "group_name": f"测试群{i}", "member_count": 10} for i in range(5)]
+TEXTS = ["你好", "今天天气不错", "hello world", "晚上一起吃饭吗", "收到", "[CQ:face,id=14]", "这个问题我看一下"]
+
+message_ids = itertools.count(random.randint(1, 10 ** 6))
+
+
+def make_event():
+    """生成一条模拟的消息事件"""
+    user = random.choice(FRIENDS)
+    event = {
+        "time": int(time.time()),
+        "self_id": SELF_ID,
+        "post_type": "message",
+        "message_id": next(message_ids),
+        "user_id": user["user_id"],
+        "raw_message": random.choice(TEXTS),
+        "font": 0,
+        "sender": {"user_id": user["user_id"], "nickname": user["nickname"]}
+    }
+    if random.random() < 0.7:
+        event["message_type"] = "group"
+        event["sub_type"] = "normal"
+        event["group_id"] = random.choice(GROUPS)["group_id"]
+        event["sender"]["card"] = ""
+    else:
+        event["message_type"] = "private"
+        event["sub_type"] = "friend"
+    event["message"] = event["raw_message"]
+    return event
+
+
+def handle_api(request):
+    """返回API请求的模拟结果"""
+    action = request.get("action")
+    params = request.get("params", {})
+    if action == "get_friend_list":
+        data = FRIENDS
+    elif action == "get_group_list":
+        data = GROUPS
+    elif action == "get_group_member_list":
+        data = [
+            {"group_id": params.get("group_id"), "user_id": f["user_id"], "nickname": f["nickname"],
+             "card": "", "role": "member"}
+            for f in FRIENDS
+        ]
+    elif action == "send_msg":
+        data = {"message_id": next(message_ids)}
+    else:
+        data = None
+    response = {"status": "ok", "retcode": 0, "data": data}
+    if "echo" in request:
+        response["echo"] = request["echo"]
+    return response
+
+
+async def serve_connection(websocket, count, interval):
+    async def send_events():
+        for _ in range(count):
+            await websocket.send(json.dumps(make_event(), ensure_ascii=False))
+            await asyncio.sleep(interval)
+
+    sender = asyncio.ensure_future(send_events())
+    try:
+        async for message in websocket:
+            request = json.loads(message)
+            print(f"收到API请求: {request.get('action')}")
+            await websocket.send(json.dumps(handle_api(request), ensure_ascii=False))
+    finally:
+        sender.cancel()
+
+
+async def run_forward(url, args):
+    import websockets
+    parts = urllib.parse.urlsplit(url)
+
+    async def handler(websocket):
+        await serve_connection(websocket, args.count, args.interval)
+
+    async with websockets.serve(handler, parts.hostname, parts.port):
+        print(f"模拟OneBot正向WebSocket服务已启动: {url}")
+        await asyncio.Future()
+
+
+async def run_reverse(url, args):
+    import websockets
+    headers = {"X-Self-ID": str(SELF_ID), "X-Client-Role": "Universal"}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+    async with websockets.connect(url, extra_headers=headers) as websocket:
+        print(f"已连接到客户端: {url}")
+        await serve_connection(websocket, args.count, args.interval)
+
+
+def run_http(url, args):
+    started = time.time()
+    for _ in range(args.count):
+        body = json.dumps(make_event(), ensure_ascii=False).encode('utf-8')
+        # 与OneBot11标准一致，上报请求只带 X-Self-ID 和 X-Signature，不带访问令牌
+        request = urllib.request.Request(url, data=body, headers={
+            "Content-Type": "application/json",
+            "X-Self-ID": str(SELF_ID)
+        })
+        if args.secret:
+            signature = hmac.new(args.secret.encode(), body, hashlib.sha1).hexdigest()
+            request.add_header("X-Signature", f"sha1={signature}")
+        with urllib.request.urlopen(request, timeout=5) as response:
+            if response.status != 204:
+                print(f"上报返回异常状态: {response.status}")
+        time.sleep(args.interval)
+    print(f"已上报{args.count}个事件，用时{time.time() - started:.2f}秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OneBot11实现")
+    parser.add_argument("mode", choices=["forward", "reverse", "http"])
+    parser.add_argument("url", help="正向模式为监听地址，反向/HTTP模式为客户端地址")
+    parser.add_argument("--token", default="", help="访问令牌")
+    parser.add_argument("--secret", default="", help="HTTP POST签名密钥")
+    parser.add_argument("--count", type=int, default=20, help="发送的事件数量")
+    parser.add_argument("--interval", type=float, default=0.5, help="事件间隔（秒）")
+    args = parser.parse_args()
+
+    if args.mode == "http":
+        run_http(args.url, args)
+    elif args.mode == "reverse":
+        asyncio.run(run_reverse(args.url, args))
+    else:
+        asyncio.run(run_forward(args.url, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,17 @@ import threading
 import time
 import tkinter as tk
 from tkinter import ttk, scrolledtext, simpledialog, messagebox
-from PIL import Image, ImageTk
-import io
-import requests
-import websockets
 import asyncio
 import datetime
-import re
+import bisect
+from chat_storage import ChatMessage, ChatStorage, MessageDeduplicator
+from search_index import SearchIndex
+from event_server import ReverseWebSocketServer, HttpPostServer, HttpApiClient
+from event_pipeline import EventPipeline
+from event_rules import EventRules, ARCHIVE, DROP
+from contact_cache import ContactCache
+from image_loader import (ImageLoader, ImageUnavailable, AnimatedImage, AnimationPlayer,
+                          IMAGE_PATTERN, image_urls, normalize_image_url)
 
 class OneBotClient:
     def __init__(self, root):
@@ -35,25 +39,85 @@ class OneBotClient:
         # 初始化变量
         self.current_conversation = None
         self.conversations = {}
-        self.websocket = None
+        self.websocket = None  # 用于发送API请求的连接
+        self.event_server = None  # 反向WebSocket / HTTP POST 模式下的事件接收服务
         self.is_connected = False
         self.lock = threading.RLock()
         self.group_members = {}  # 存储群成员信息
-        self.image_cache = {}  # 缓存已加载的图片
+        self.self_id = ""  # 当前登录账号，从事件的 self_id 获取
+        self.view_start = 0  # 当前聊天区域显示的第一条消息的位置
+        self.view_end = 0  # 当前聊天区域显示的最后一条消息之后的位置
+        self.view_live = True  # 是否显示到最新消息，新消息到达时直接追加
+        self.view_top = None  # 最上方的日期分隔线
+        self.view_top_date = None
+        self.view_bottom_date = None
+        self.load_older_button = None
+        self.load_newer_button = None
         
         # 加载配置
         self.config = self.load_config()
         
+        # 聊天记录存储，内存中每个对话只保留最近的一段消息
+        self.storage = ChatStorage(
+            "chat_history",
+            window_messages=self.config.get("history_window_messages", 200),
+            window_bytes=self.config.get("history_window_bytes", 256 * 1024)
+        )
+        self.search_index = SearchIndex("search_index")
+        self.deduplicator = MessageDeduplicator(self.storage, self.config.get("dedup_capacity", 20000))
+        # 好友、群和群成员列表的快照，重连时先用快照显示，再只更新有变化的项
+        self.contacts = ContactCache(os.path.join("cache", "contacts"))
+        # 消息过滤规则，启动时编译一次
+        self.rules = EventRules(self.config.get("rules", []))
+        # 图片在后台线程下载和解码，不在查看的对话中收到的图片低优先级预取
+        self.image_loader = ImageLoader(
+            self.root,
+            os.path.join("cache", "pictures"),
+            cache_bytes=self.config.get("image_cache_mb", 32) * 1024 * 1024
+        )
+        # 所有动图共用一个定时器，只播放聊天区域中可见的动图
+        self.animation_player = AnimationPlayer(self.root, self.is_widget_visible)
+        
+        # 接收事件的分级处理管道：API响应优先，聊天消息进入有界队列
+        self.pipeline = EventPipeline(
+            self.handle_message,
+            maxsize=self.config.get("event_queue_size", 2000),
+            overflow=self.config.get("event_overflow_policy", "block"),
+            spill_path=os.path.join("cache", "event_spill.jsonl"),
+            is_muted=self.is_muted_event
+        )
+        
         # 创建界面
         self.create_widgets()
         
-        # 加载聊天记录
-        self.load_chat_history()
-        
         # 启动异步事件循环线程
         self.loop = asyncio.new_event_loop()
         self.loop_thread = threading.Thread(target=self.run_event_loop, daemon=True)
         self.loop_thread.start()
+        
+        # 先让窗口显示出来，再加载聊天记录（after_idle 之后的第一个事件循环周期）
+        self.root.after_idle(lambda: self.root.after(0, self.finish_startup))
+    
+    def finish_startup(self):
+        """窗口显示后再执行的启动工作"""
+        # 加载聊天记录
+        self.load_chat_history()
+        
+        # 用上次保存的联系人快照填充对话列表和群成员信息，不必等待连接
+        self.contacts.load()
+        entries = self.update_conversations(self.contacts.items("friends"), "", "👤")
+        entries += self.update_conversations(self.contacts.items("groups"), "group_", "👥")
+        self.group_members.update(self.contacts.members())
+        if entries:
+            self.conversation_list.add_many(entries)
+        
+        # 聊天记录加载完成后才开始处理事件：上次溢出到磁盘的事件会立即回放，
+        # 如果先于加载处理，会为已有对话新建空记录并覆盖已保存的消息
+        asyncio.run_coroutine_threadsafe(self.pipeline.run(), self.loop)
+        
+        # 在后台打开（或首次构建）搜索索引，打开前收到的消息会先排队
+        threading.Thread(target=self.search_index.open,
+                         args=(self.storage, self.conversations), daemon=True).start()
     
     def load_config(self):
         config_path = "config.json"
@@ -81,32 +145,23 @@ class OneBotClient:
             messagebox.showerror("错误", "保存配置文件失败")
     
     def load_chat_history(self):
-        history_dir = "chat_history"
-        if not os.path.exists(history_dir):
-            os.makedirs(history_dir)
-            return
-        
-        for filename in os.listdir(history_dir):
-            if filename.endswith(".json"):
-                try:
-                    with open(os.path.join(history_dir, filename), 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        self.conversations[data["id"]] = data
-                        self.add_conversation_to_sidebar(data["id"], data["name"], data.get("avatar", "👤"))
-                except:
-                    pass
+        entries = []
+        for data in self.storage.load_all():
+            try:
+                self.conversations[data["id"]] = data
+                messages = data.get("messages", [])
+                last_active = messages[-1].timestamp if messages else 0
+                entries.append((data["id"], data["name"], data.get("avatar", "👤"), last_active))
+            except:
+                pass
+        self.conversation_list.add_many(entries)
     
     def save_chat_history(self, conversation_id):
         if conversation_id not in self.conversations:
             return
         
-        history_dir = "chat_history"
-        if not os.path.exists(history_dir):
-            os.makedirs(history_dir)
-        
         try:
-            with open(os.path.join(history_dir, f"{conversation_id}.json"), 'w', encoding='utf-8') as f:
-                json.dump(self.conversations[conversation_id], f, ensure_ascii=False, indent=2)
+            self.storage.save(self.conversations[conversation_id])
         except:
             messagebox.showerror("错误", "保存聊天记录失败")
     
@@ -138,12 +193,33 @@ class OneBotClient:
         refresh_members_button = ttk.Button(sidebar_frame, text="刷新群成员", command=self.refresh_group_members)
         refresh_members_button.pack(pady=5, padx=10, fill=tk.X)
         
+        # 按日期跳转按钮
+        jump_button = ttk.Button(sidebar_frame, text="跳转到日期", command=self.show_jump_to_date)
+        jump_button.pack(pady=5, padx=10, fill=tk.X)
+        
+        # 运行状态按钮
+        status_button = ttk.Button(sidebar_frame, text="运行状态", command=self.show_status)
+        status_button.pack(pady=5, padx=10, fill=tk.X)
+        
+        # 搜索框
+        self.search_entry = ttk.Entry(sidebar_frame)
+        self.search_entry.pack(pady=5, padx=10, fill=tk.X)
+        self.search_entry.bind("<Return>", lambda e: self.show_search())
+        search_button = ttk.Button(sidebar_frame, text="搜索消息", command=self.show_search)
+        search_button.pack(pady=5, padx=10, fill=tk.X)
+        
         # 分割线
         ttk.Separator(sidebar_frame, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=10)
         
-        # 对话列表
-        self.conversation_list_frame = ttk.Frame(sidebar_frame)
-        self.conversation_list_frame.pack(fill=tk.BOTH, expand=True)
+        # 对话列表过滤框
+        self.filter_var = tk.StringVar()
+        filter_entry = ttk.Entry(sidebar_frame, textvariable=self.filter_var)
+        filter_entry.pack(pady=(0, 5), padx=10, fill=tk.X)
+        self.filter_var.trace_add("write", lambda *args: self.conversation_list.set_filter(self.filter_var.get()))
+        
+        # 对话列表（只绘制可见的行，按最近活跃时间排序）
+        self.conversation_list = ConversationList(sidebar_frame, self.select_conversation, bg=self.bg_color)
+        self.conversation_list.pack(fill=tk.BOTH, expand=True)
         
         # 创建右侧聊天区域
         chat_frame = ttk.Frame(main_frame)
@@ -166,7 +242,7 @@ class OneBotClient:
         # 添加滚动条
         self.chat_scrollbar = ttk.Scrollbar(self.chat_canvas_frame, orient=tk.VERTICAL, command=self.chat_canvas.yview)
         self.chat_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.chat_canvas.config(yscrollcommand=self.chat_scrollbar.set)
+        self.chat_canvas.config(yscrollcommand=self.on_chat_scroll)
         
         # 创建内容框架
         self.message_frame = ttk.Frame(self.chat_canvas)
@@ -175,6 +251,8 @@ class OneBotClient:
         # 绑定事件更新滚动区域
         self.message_frame.bind("<Configure>", self.on_message_frame_configure)
         self.chat_canvas.bind("<Configure>", self.on_chat_canvas_configure)
+        # 窗口从最小化恢复时重新开始播放动图
+        self.root.bind("<Map>", lambda e: self.animation_player.schedule_refresh(), add="+")
         
         # 输入框和发送按钮
         input_frame = ttk.Frame(chat_frame)
@@ -194,36 +272,37 @@ class OneBotClient:
         style.configure("Header.TLabel", background=self.header_bg, foreground=self.header_text, font=("微软雅黑", 12, "bold"))
         style.configure("MessageFrame.TFrame", background=self.message_other_bg, relief="flat", borderwidth=0)
         style.configure("SelfMessageFrame.TFrame", background=self.message_self_bg, relief="flat", borderwidth=0)
+        style.configure("Highlight.TFrame", background="#fff3cd")
     
-    def add_conversation_to_sidebar(self, conversation_id, name, avatar="👤"):
-        # 创建对话项框架
-        conversation_frame = ttk.Frame(self.conversation_list_frame)
-        conversation_frame.pack(fill=tk.X, padx=5, pady=2)
-        conversation_frame.bind("<Button-1>", lambda e, cid=conversation_id: self.select_conversation(cid))
-        
-        # 头像
-        avatar_label = ttk.Label(conversation_frame, text=avatar, font=("微软雅黑", 14))
-        avatar_label.pack(side=tk.LEFT, padx=5, pady=5)
-        
-        # 名称
-        name_label = ttk.Label(conversation_frame, text=name, font=("微软雅黑", 10))
-        name_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5, pady=5, anchor="w")
-        
-        # 存储对话ID
-        conversation_frame.conversation_id = conversation_id
+    def add_conversation_to_sidebar(self, conversation_id, name, avatar="👤", last_active=0):
+        self.conversation_list.add_many([(conversation_id, name, avatar, last_active)])
     
     def on_message_frame_configure(self, event=None):
         """更新Canvas的滚动区域"""
         self.chat_canvas.configure(scrollregion=self.chat_canvas.bbox("all"))
         
+    def on_chat_scroll(self, first, last):
+        """聊天区域滚动或内容变化：更新滚动条，并重新计算哪些动图可见"""
+        self.chat_scrollbar.set(first, last)
+        self.animation_player.schedule_refresh()
+    
+    def is_widget_visible(self, widget):
+        """控件是否在聊天区域的可见范围内"""
+        if not widget.winfo_ismapped():
+            return False
+        top = widget.winfo_rooty() - self.chat_canvas.winfo_rooty()
+        return top < self.chat_canvas.winfo_height() and top + widget.winfo_height() > 0
+    
     def on_chat_canvas_configure(self, event=None):
         """当Canvas大小改变时调整内容框架宽度"""
         width = event.width
         self.chat_canvas.itemconfig(self.chat_canvas.find_all()[0], width=width)
     
-    def select_conversation(self, conversation_id):
+    def select_conversation(self, conversation_id, focus=None):
+        """切换对话；focus 为 (时间戳, 消息ID) 时显示该消息附近的记录并滚动到它"""
         # 更新当前选中的对话
         self.current_conversation = conversation_id
+        self.conversation_list.set_selected(conversation_id)
         
         # 清空聊天区域
         if conversation_id not in self.conversations:
@@ -233,13 +312,17 @@ class OneBotClient:
         conv = self.conversations[conversation_id]
         self.chat_header.config(text=conv["name"])
         
-        # 清空消息框架
-        for widget in self.message_frame.winfo_children():
-            widget.destroy()
-        
-        # 显示聊天记录
-        for msg in conv.get("messages", []):
-            self.display_message(msg["sender"], msg["content"], msg["time"], msg["is_self"])
+        if focus is not None:
+            self.show_message_context(conv, *focus)
+        else:
+            # 显示聊天记录（只显示内存中的窗口，更早的消息按需从归档读取）
+            total = self.storage.total_count(conv)
+            self.reset_view(self.storage.archived_count(conversation_id))
+            self.render_messages(conv.get("messages", []))
+            self.view_end = total
+            self.update_view_buttons()
+            # 滚动到底部
+            self.root.after(0, lambda: self.chat_canvas.yview_moveto(1.0))
         
         # 如果是群聊，自动获取群成员信息
         if conversation_id.startswith('group_'):
@@ -247,14 +330,207 @@ class OneBotClient:
             # 如果群成员信息不存在或为空，自动获取
             if group_id not in self.group_members or not self.group_members.get(group_id, {}):
                 asyncio.run_coroutine_threadsafe(self.fetch_group_members(group_id), self.loop)
+    
+    def show_message_context(self, conv, timestamp, message_id):
+        """显示指定消息及其前后的记录，高亮并滚动到该消息"""
+        position, target = self.storage.find_message(conv, timestamp, message_id)
+        page_size = self.config.get("history_page_size", 50)
+        start = max(0, position - 10)
+        messages = self.storage.read_messages(conv, start, start + page_size)
+        
+        self.reset_view(start)
+        containers = self.render_messages(messages)
+        self.view_end = start + len(messages)
+        self.update_view_buttons()
+        
+        if target is None or position - start >= len(containers):
+            return
+        container = containers[position - start]
+        container.configure(style="Highlight.TFrame")
+        
+        def scroll_to_message():
+            self.message_frame.update_idletasks()
+            height = self.message_frame.winfo_height()
+            if height > 0:
+                self.chat_canvas.yview_moveto(max(0.0, container.winfo_y() - 20) / height)
+        
+        self.root.after(0, scroll_to_message)
+    
+    def reset_view(self, position):
+        """清空聊天区域，从指定位置开始显示"""
+        for widget in self.message_frame.winfo_children():
+            widget.destroy()
+        self.view_start = self.view_end = position
+        self.view_top = self.view_top_date = self.view_bottom_date = None
+        self.load_older_button = self.load_newer_button = None
+    
+    def render_messages(self, messages, prepend=False):
+        """显示一批消息，日期变化处插入日期分隔线
+
+        prepend 为 True 时插入到已显示消息的上方，否则追加到下方，返回每条消息的容器
+        """
+        if not messages:
+            return []
+        
+        containers = []
+        before = self.view_top if prepend and self.view_top else self.load_newer_button
+        last_date = None if prepend else self.view_bottom_date
+        first_separator = None
+        for msg in messages:
+            date = datetime.date.fromtimestamp(msg.timestamp)
+            if date != last_date:
+                separator = self.display_date_separator(date, before=before)
+                if first_separator is None:
+                    first_separator = separator
+            containers.append(self.display_message(msg, before=before))
+            last_date = date
+        
+        first_date = datetime.date.fromtimestamp(messages[0].timestamp)
+        if prepend:
+            # 与原来最上方的消息同一天时，去掉原来的分隔线
+            if self.view_top and self.view_top_date == last_date:
+                self.view_top.destroy()
+            self.view_top, self.view_top_date = first_separator, first_date
+        else:
+            if self.view_top is None:
+                self.view_top, self.view_top_date = first_separator, first_date
+            self.view_bottom_date = last_date
+        return containers
+    
+    def display_date_separator(self, date, before=None):
+        """显示日期分隔线"""
+        separator = ttk.Label(self.message_frame, text=f"—— {date.strftime('%Y-%m-%d')} ——",
+                              font=("微软雅黑", 9), foreground=self.message_time_color, anchor="center")
+        if before is not None:
+            separator.pack(fill=tk.X, pady=5, before=before)
+        else:
+            separator.pack(fill=tk.X, pady=5)
+        return separator
+    
+    def update_view_buttons(self):
+        """根据显示范围添加或移除"加载更早/更新的消息"按钮"""
+        total = self.storage.total_count(self.conversations[self.current_conversation])
+        self.view_live = self.view_end >= total
+        
+        if self.view_start > 0:
+            if not self.load_older_button:
+                self.load_older_button = ttk.Button(self.message_frame, text="加载更早的消息", command=self.load_older_messages)
+                children = self.message_frame.winfo_children()
+                if len(children) > 1:
+                    self.load_older_button.pack(pady=5, before=children[0])
+                else:
+                    self.load_older_button.pack(pady=5)
+        elif self.load_older_button:
+            self.load_older_button.destroy()
+            self.load_older_button = None
+        
+        if not self.view_live:
+            if not self.load_newer_button:
+                self.load_newer_button = ttk.Button(self.message_frame, text="加载更新的消息", command=self.load_newer_messages)
+                self.load_newer_button.pack(pady=5)
+        elif self.load_newer_button:
+            self.load_newer_button.destroy()
+            self.load_newer_button = None
+    
+    def load_older_messages(self):
+        """从归档中读取当前显示范围之前的一页消息"""
+        if not self.current_conversation or self.current_conversation not in self.conversations:
+            return
+        
+        conv = self.conversations[self.current_conversation]
+        page_size = self.config.get("history_page_size", 50)
+        start = max(0, self.view_start - page_size)
+        messages = self.storage.read_messages(conv, start, self.view_start)
+        self.view_start = start
+        
+        # 插入到已显示消息的前面
+        self.render_messages(messages, prepend=True)
+        self.update_view_buttons()
+        
+        self.root.after(0, lambda: self.chat_canvas.yview_moveto(0.0))
+    
+    def load_newer_messages(self):
+        """读取当前显示范围之后的一页消息"""
+        if not self.current_conversation or self.current_conversation not in self.conversations:
+            return
         
-        # 滚动到底部
-        self.root.after(0, lambda: self.chat_canvas.yview_moveto(1.0))
+        conv = self.conversations[self.current_conversation]
+        page_size = self.config.get("history_page_size", 50)
+        messages = self.storage.read_messages(conv, self.view_end, self.view_end + page_size)
+        self.render_messages(messages)
+        self.view_end += len(messages)
+        self.update_view_buttons()
     
-    def display_message(self, sender, content, time_str, is_self):
+    def append_live_message(self, msg):
+        """新消息到达时追加到聊天区域（仅在显示到最新消息时）"""
+        if not self.view_live:
+            self.update_view_buttons()
+            return
+        self.render_messages([msg])
+        self.view_end += 1
+        self.chat_canvas.yview_moveto(1.0)
+    
+    def show_search(self):
+        """打开搜索窗口"""
+        SearchDialog(self, self.search_entry.get().strip())
+    
+    def open_search_hit(self, hit):
+        """打开搜索结果所在的对话并定位到该消息"""
+        if hit.conversation_id not in self.conversations:
+            return
+        self.select_conversation(hit.conversation_id, focus=(hit.timestamp, hit.message_id))
+    
+    def show_jump_to_date(self):
+        """按日期跳转，或显示某个日期范围内的消息"""
+        if not self.current_conversation or self.current_conversation not in self.conversations:
+            messagebox.showinfo("提示", "请先选择一个对话")
+            return
+        
+        dialog = JumpToDateDialog(self.root)
+        if not dialog.result:
+            return
+        
+        start_date, end_date = dialog.result
+        self.jump_to_time(
+            self.date_to_timestamp(start_date),
+            self.date_to_timestamp(end_date + datetime.timedelta(days=1)) if end_date else None
+        )
+    
+    @staticmethod
+    def date_to_timestamp(date):
+        return int(datetime.datetime.combine(date, datetime.time()).timestamp())
+    
+    def jump_to_time(self, start_time, end_time=None):
+        """显示从 start_time 开始的消息；指定 end_time 时只显示该时间范围内的消息"""
+        conv = self.conversations[self.current_conversation]
+        page_size = self.config.get("history_page_size", 50)
+        if end_time is None:
+            position = self.storage.position_at(conv, start_time)
+            messages = self.storage.read_messages(conv, position, position + page_size)
+        else:
+            limit = self.config.get("history_range_limit", 1000)
+            position, messages = self.storage.read_range(conv, start_time, end_time, limit)
+        
+        self.reset_view(position)
+        self.render_messages(messages)
+        self.view_end = position + len(messages)
+        self.update_view_buttons()
+        if not messages:
+            self.display_date_separator(datetime.date.fromtimestamp(start_time), before=self.load_newer_button)
+        
+        self.root.after(0, lambda: self.chat_canvas.yview_moveto(0.0))
+    
+    def display_message(self, msg, before=None):
+        sender, content, is_self = msg.sender, msg.content, msg.is_self
+        # 时间只在显示时格式化
+        time_str = msg.format_time()
+        
         # 创建消息容器
         message_container = ttk.Frame(self.message_frame)
-        message_container.pack(fill=tk.X, padx=5, pady=5)
+        if before is not None:
+            message_container.pack(fill=tk.X, padx=5, pady=5, before=before)
+        else:
+            message_container.pack(fill=tk.X, padx=5, pady=5)
         
         # 发送者信息标签 - 添加日志输出
         print(f"显示消息 - 发送者: {sender}, 类型: {'自己' if is_self else '他人'}")
@@ -267,7 +543,7 @@ class OneBotClient:
         content_frame.pack(anchor="w" if not is_self else "e", padx=10, fill=tk.X)
         
         # 检查是否包含图片 - 添加更详细的日志
-        image_pattern = re.compile(r'\[CQ:image,file=(.*?),url=(.*?)\]')
+        image_pattern = IMAGE_PATTERN
         image_matches = image_pattern.findall(content)
         
         if image_matches:
@@ -296,231 +572,40 @@ class OneBotClient:
         
         # 更新滚动区域
         self.on_message_frame_configure()
+        return message_container
         
     def display_image(self, parent_frame, image_url, is_self):
-        """显示图片"""
-        try:
-            print(f"开始处理图片URL: {image_url}")
-            # 清理URL，移除可能的转义字符并解码HTML实体
-            import html
-            import urllib.parse
-            
-            # 解码HTML实体
-            image_url = html.unescape(image_url.strip())
-            print(f"HTML解码后: {image_url}")
-            
-            # 修复URL中的常见问题
-            image_url = image_url.replace('&amp;', '&')
-            
-            # 处理URL编码问题
-            try:
-                # 检查是否已经是有效的URL，尝试解码一次
-                if '%' in image_url:
-                    image_url = urllib.parse.unquote(image_url)
-                    print(f"URL解码后: {image_url}")
-            except Exception as decode_error:
-                print(f"URL解码失败: {decode_error}")
-            
-            # 处理特殊格式的URL，如QQ图片URL末尾的file_size参数
-            if ',file_size=' in image_url:
-                image_url = image_url.split(',file_size=')[0]
-                print(f"移除file_size参数后: {image_url}")
-            
-            # 确保URL格式正确
-            if not image_url.startswith(('http://', 'https://', 'file:///')):
-                # 尝试添加默认协议
-                if image_url.startswith('//'):
-                    image_url = 'https:' + image_url
-                elif '.' in image_url and ('/' in image_url or '\\' in image_url):
-                    # 可能是相对路径或不完整URL，尝试添加https协议
-                    image_url = 'https://' + image_url
-                print(f"修正协议后: {image_url}")
-            
-            # 检查缓存
-            if image_url in self.image_cache:
-                photo = self.image_cache[image_url]
-                image_label = ttk.Label(parent_frame, image=photo)
-                image_label.image = photo  # 保持引用防止被垃圾回收
-                image_label.pack(anchor="w" if not is_self else "e", padx=5, pady=5)
-                print(f"使用缓存的图片: {image_url}")
+        """显示图片：先放一个按图片大小预留的占位框，加载完成后再显示图片"""
+        image_url = normalize_image_url(image_url)
+        anchor = "w" if not is_self else "e"
+        
+        # 预取过或显示过的图片已知道大小，占位框和图片一样大，加载完成后布局不会跳动
+        width, height = self.image_loader.size_hint(image_url)
+        placeholder = tk.Frame(parent_frame, width=width, height=height, background="#f0f0f0")
+        placeholder.pack_propagate(False)
+        placeholder.pack(anchor=anchor, padx=5, pady=5)
+        image_label = ttk.Label(placeholder, text="[图片加载中...]", font=("微软雅黑", 10), foreground="gray")
+        image_label.pack(expand=True)
+        
+        def on_loaded(image, error):
+            if not placeholder.winfo_exists():
                 return
-            
-            # 在单独的线程中加载图片
-            threading.Thread(target=self._load_and_display_image, 
-                           args=(parent_frame, image_url, is_self)).start()
-        except Exception as e:
-            print(f"显示图片失败: {e}")
-            # 显示错误文本
-            if parent_frame.winfo_exists():
-                error_label = ttk.Label(parent_frame, text="[图片加载失败]", font=("微软雅黑", 10), foreground="red")
-                error_label.pack(anchor="w" if not is_self else "e", padx=5, pady=5)
-    
-    def _load_and_display_image(self, parent_frame, image_url, is_self):
-        """在线程中加载图片"""
-        try:
-            print(f"尝试加载图片: {image_url}")
-            
-            # 处理可能的本地文件路径
-            if image_url.startswith("file:///"):
-                # 处理本地文件路径
-                file_path = image_url[8:]  # 移除 'file:///'
-                if os.path.exists(file_path):
-                    # 打开本地图片
-                    image = Image.open(file_path)
-                else:
-                    raise FileNotFoundError(f"本地图片文件不存在: {file_path}")
+            if image is not None:
+                placeholder.configure(width=image.width(), height=image.height())
+                photo = image.photo(0) if isinstance(image, AnimatedImage) else image
+                image_label.configure(image=photo, text="", padding=0)
+                image_label.image = photo  # 保持引用防止被垃圾回收
+                if isinstance(image, AnimatedImage):
+                    self.animation_player.add(image_label, image)
+            elif isinstance(error, ImageUnavailable):
+                placeholder.pack_propagate(True)
+                image_label.configure(text=str(error), foreground="blue")
             else:
-                # 处理CQ码图片的特殊情况
-                # 对于OneBot协议，file参数可能是本地文件ID而不是URL
-                # 我们可以尝试从消息中提取file参数而不是使用url
-                if "file=" in image_url and ",url=" in image_url:
-                    # 这可能是一个CQ码，我们提取file部分
-                    file_match = re.search(r'file=([^,]+)', image_url)
-                    if file_match:
-                        file_id = file_match.group(1)
-                        # 对于无法直接访问的URL，我们可以尝试使用本地文件或显示占位符
-                        print(f"检测到CQ码图片，文件ID: {file_id}")
-                        
-                        # 在主线程中显示一个图片占位符
-                        def show_placeholder():
-                            if parent_frame.winfo_exists():
-                                placeholder_label = ttk.Label(parent_frame, text=f"[图片: {file_id[:10]}...]", 
-                                                          font=("微软雅黑", 10), foreground="blue")
-                                placeholder_label.pack(anchor="w" if not is_self else "e", padx=5, pady=5)
-                                self.on_message_frame_configure()
-                        
-                        self.root.after(0, show_placeholder)
-                        return
-                
-                # 下载网络图片
-                # 增强HTTP请求头，特别是针对QQ图片
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept': 'image/webp,*/*',
-                    'Accept-Language': 'zh-CN,zh;q=0.9',
-                    'Referer': 'https://im.qq.com/',  # 添加QQ相关引用来源
-                    'Connection': 'keep-alive',
-                    'Pragma': 'no-cache',
-                    'Cache-Control': 'no-cache'
-                }
-                
-                # 为QQ图片添加特定处理
-                if 'qq.com' in image_url:
-                    print(f"处理QQ图片URL: {image_url}")
-                    # 尝试直接下载QQ图片到本地缓存
-                    try:
-                        # 创建本地缓存目录
-                        import os
-                        cache_dir = os.path.join(os.getcwd(), 'cache', 'pictures')
-                        if not os.path.exists(cache_dir):
-                            os.makedirs(cache_dir)
-                            print(f"创建缓存目录: {cache_dir}")
-                        
-                        # 生成文件名（使用URL的哈希值作为文件名）
-                        import hashlib
-                        file_hash = hashlib.md5(image_url.encode()).hexdigest()
-                        file_extension = '.jpg'  # 默认使用jpg扩展名
-                        file_path = os.path.join(cache_dir, f"{file_hash}{file_extension}")
-                        
-                        # 检查是否已缓存
-                        if os.path.exists(file_path):
-                            print(f"使用缓存的本地图片: {file_path}")
-                            image = Image.open(file_path)
-                        else:
-                            print(f"尝试下载图片到缓存: {file_path}")
-                            # 增强HTTP请求头以尝试绕过QQ图片的限制
-                            qq_headers = headers.copy()
-                            qq_headers['Referer'] = 'https://im.qq.com/'
-                            qq_headers['Origin'] = 'https://im.qq.com'
-                            qq_headers['Accept-Encoding'] = 'gzip, deflate, br'
-                            
-                            # 下载图片
-                            response = requests.get(image_url, headers=qq_headers, timeout=20, 
-                                                  allow_redirects=True, stream=True)
-                            response.raise_for_status()
-                            
-                            # 保存图片到本地
-                            with open(file_path, 'wb') as f:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    if chunk:
-                                        f.write(chunk)
-                            
-                            print(f"图片保存成功: {file_path}")
-                            # 打开已保存的图片
-                            image = Image.open(file_path)
-                        
-                        # 继续处理图片（调整大小等）
-                        # 注意：这里不return，让代码继续执行后面的图片处理逻辑
-                    except Exception as qq_error:
-                        print(f"QQ图片下载失败: {qq_error}")
-                        # 如果下载失败，再显示占位符作为后备方案
-                
-                # 处理URL中的特殊字符
-                try:
-                    import urllib.parse
-                    image_url = urllib.parse.unquote(image_url)
-                except:
-                    pass
-                
-                try:
-                    response = requests.get(image_url, headers=headers, timeout=15, allow_redirects=True)
-                    response.raise_for_status()  # 检查响应状态
-                    
-                    # 验证是否为图片数据
-                    content_type = response.headers.get('Content-Type', '')
-                    if not content_type.startswith('image/'):
-                        raise ValueError(f"不是有效的图片格式: {content_type}")
-                    
-                    image_data = io.BytesIO(response.content)
-                    # 打开图片并调整大小
-                    image = Image.open(image_data)
-                except Exception as inner_e:
-                    print(f"下载图片失败，尝试备用方法: {inner_e}")
-                    # 备用方案：显示图片URL作为文本
-                    def show_url_as_text():
-                        if parent_frame.winfo_exists():
-                            url_label = ttk.Label(parent_frame, text=f"[图片URL: {image_url[:30]}...]", 
-                                                font=("微软雅黑", 10), foreground="blue")
-                            url_label.pack(anchor="w" if not is_self else "e", padx=5, pady=5)
-                            self.on_message_frame_configure()
-                    
-                    self.root.after(0, show_url_as_text)
-                    return
-            
-            # 调整图片大小
-            max_width, max_height = 300, 300
-            image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            # 转换为Tkinter可用的格式
-            photo = ImageTk.PhotoImage(image)
-            
-            # 缓存图片
-            self.image_cache[image_url] = photo
-            
-            # 在主线程中更新UI
-            def update_ui():
-                 if parent_frame.winfo_exists():
-                     image_label = ttk.Label(parent_frame, image=photo)
-                     image_label.image = photo  # 保持引用
-                     image_label.pack(anchor="w" if not is_self else "e", padx=5, pady=5)
-                     # 更新滚动区域
-                     self.on_message_frame_configure()
-            
-            self.root.after(0, update_ui)
-        except Exception as e:
-            print(f"加载图片失败: {e}, URL: {image_url}")
-            
-            # 显示更详细的错误信息
-            error_msg = f"[图片加载失败: {str(e)[:20]}...]"
-            
-            def update_error_ui():
-                 # 确保parent_frame是有效的窗口对象
-                 if parent_frame.winfo_exists():
-                     error_label = ttk.Label(parent_frame, text=error_msg, font=("微软雅黑", 10), foreground="red")
-                     error_label.pack(anchor="w" if not is_self else "e", padx=5, pady=5)
-                     self.on_message_frame_configure()
-            
-            self.root.after(0, update_error_ui)
+                placeholder.pack_propagate(True)
+                image_label.configure(text=f"[图片加载失败: {str(error)[:20]}...]", foreground="red")
+            self.on_message_frame_configure()
+        
+        self.image_loader.request(image_url, on_loaded)
     
     def send_message(self, event=None):
         if not self.is_connected or not self.current_conversation:
@@ -532,26 +617,18 @@ class OneBotClient:
         
         self.input_text.delete("1.0", tk.END)
         
-        # 获取当前时间
-        time_str = datetime.datetime.now().strftime("%H:%M:%S")
-        
-        # 显示自己发送的消息
-        self.display_message("我", content, time_str, True)
-        self.root.after(0, lambda: self.chat_canvas.yview_moveto(1.0))
+        msg = ChatMessage(time.time(), self.self_id, "我", content, True)
         
         # 添加到聊天记录
         if self.current_conversation not in self.conversations:
             return
         
-        if "messages" not in self.conversations[self.current_conversation]:
-            self.conversations[self.current_conversation]["messages"] = []
+        self.storage.append(self.conversations[self.current_conversation], msg)
+        self.search_index.add(self.current_conversation, msg)
+        self.conversation_list.touch(self.current_conversation, msg.timestamp)
         
-        self.conversations[self.current_conversation]["messages"].append({
-            "sender": "我",
-            "content": content,
-            "time": time_str,
-            "is_self": True
-        })
+        # 显示自己发送的消息
+        self.append_live_message(msg)
         
         # 保存聊天记录
         self.save_chat_history(self.current_conversation)
@@ -600,6 +677,11 @@ class OneBotClient:
             asyncio.run_coroutine_threadsafe(self.connect(), self.loop)
     
     async def connect(self):
+        mode = self.config.get("connection_mode", "forward")
+        if mode in ("reverse_ws", "http_post"):
+            await self.start_event_server(mode)
+            return
+        
         try:
             self.is_connected = True
             self.root.after(0, lambda: self.chat_header.config(text="正在连接服务器..."))
@@ -608,6 +690,7 @@ class OneBotClient:
             if self.config["token"]:
                 uri += f"?access_token={self.config['token']}"
             
+            import websockets
             self.websocket = await websockets.connect(uri)
             self.root.after(0, lambda: self.chat_header.config(text="已连接到服务器"))
             
@@ -634,10 +717,61 @@ class OneBotClient:
             self.root.after(0, lambda: messagebox.showerror("错误", f"连接服务器失败: {str(e)}"))
             self.root.after(0, lambda: self.chat_header.config(text="连接失败"))
     
-    async def disconnect(self):
+    async def start_event_server(self, mode):
+        """启动反向WebSocket或HTTP POST事件接收服务，由OneBot实现主动推送事件"""
+        host = self.config.get("listen_host", "127.0.0.1")
+        port = int(self.config.get("listen_port", 8081))
+        token = self.config.get("token", "")
         try:
+            if mode == "reverse_ws":
+                self.event_server = ReverseWebSocketServer(host, port, token, self.pipeline.submit,
+                                                           self.on_bot_connect, self.on_bot_disconnect)
+                address = f"ws://{host}:{port}"
+            else:
+                self.event_server = HttpPostServer(host, port, self.config.get("secret", ""), self.pipeline.submit)
+                address = f"http://{host}:{port}"
+                # HTTP POST 只能接收事件，配置了HTTP API地址时才能调用接口
+                if self.config.get("http_api_url"):
+                    self.websocket = HttpApiClient(self.config["http_api_url"], token, self.pipeline.submit)
+            
+            await self.event_server.start()
+            self.is_connected = True
+            print(f"事件接收服务已启动: {address}")
+            self.root.after(0, lambda: self.chat_header.config(text=f"正在监听 {address}，等待机器人连接"))
+            
             if self.websocket:
+                await self.fetch_conversations()
+        except Exception as e:
+            self.is_connected = False
+            self.event_server = None
+            self.websocket = None
+            print(f"启动事件接收服务失败: {e}")
+            self.root.after(0, lambda: messagebox.showerror("错误", f"启动事件接收服务失败: {str(e)}"))
+            self.root.after(0, lambda: self.chat_header.config(text="启动失败"))
+    
+    def on_bot_connect(self, self_id, websocket):
+        """反向WebSocket有机器人连入，使用最新的连接发送API请求"""
+        self.websocket = websocket
+        if self_id:
+            self.self_id = self_id
+        self.root.after(0, lambda: self.chat_header.config(text=f"机器人 {self_id} 已连接"))
+        self.loop.create_task(self.fetch_conversations())
+    
+    def on_bot_disconnect(self, self_id, websocket):
+        if self.websocket is websocket:
+            # 还有其他机器人在线时改用其他连接
+            remaining = list(self.event_server.connections.values()) if self.event_server else []
+            self.websocket = remaining[-1] if remaining else None
+        self.root.after(0, lambda: self.chat_header.config(text=f"机器人 {self_id} 已断开"))
+    
+    async def disconnect(self):
+        try:
+            if self.event_server:
+                await self.event_server.stop()
+                self.event_server = None
+            elif self.websocket:
                 await self.websocket.close()
+            self.websocket = None
             self.is_connected = False
             self.root.after(0, lambda: self.chat_header.config(text="已断开连接"))
         except Exception as e:
@@ -647,7 +781,8 @@ class OneBotClient:
         try:
             while self.is_connected and self.websocket:
                 message = await self.websocket.recv()
-                self.handle_message(message)
+                # 放入处理队列，队列满时在这里等待，不再继续读取
+                await self.pipeline.submit(message)
         except Exception as e:
             print(f"监听消息失败: {e}")
             self.is_connected = False
@@ -657,13 +792,37 @@ class OneBotClient:
             if self.config.get("auto_reconnect", True):
                 self.root.after(5000, lambda: asyncio.run_coroutine_threadsafe(self.connect(), self.loop))
     
-    def handle_message(self, message):
+    def is_muted_event(self, data):
+        """事件是否属于免打扰对话或被规则设为只存档/丢弃（队列满时可以优先丢弃）"""
+        if self.rules.evaluate(data, record=False) in (ARCHIVE, DROP):
+            return True
+        muted = self.config.get("muted_conversations", [])
+        if not muted:
+            return False
+        if data.get("message_type") == "group":
+            return f"group_{data.get('group_id')}" in muted
+        return str(data.get("user_id")) in muted
+    
+    def show_status(self):
+        """显示事件处理管道的运行状态"""
+        status = self.pipeline.format_metrics()
+        status += f"\n已过滤重复消息: {self.deduplicator.suppressed}"
+        status += f"\n规则匹配: 丢弃 {self.rules.counters[DROP]}，只存档 {self.rules.counters[ARCHIVE]}"
+        status += "\n图片: 加载 {loaded}，预取 {prefetched}，缓存命中 {cache_hits}，失败 {failed}".format(**self.image_loader.counters)
+        status += "\n" + self.animation_player.format_metrics()
+        messagebox.showinfo("运行状态", status)
+    
+    def handle_message(self, data):
+        """处理一条已解码的事件或API响应（由处理管道调用）"""
         try:
-            data = json.loads(message)
+            # 先按规则过滤，被丢弃的消息不做任何处理
+            action = self.rules.evaluate(data)
+            if action == DROP:
+                return
             
             # 处理消息事件
             if "message_type" in data and data["message_type"] in ["private", "group"]:
-                self.process_chat_message(data)
+                self.process_chat_message(data, archive_only=action == ARCHIVE)
             
             # 处理API调用结果
             elif "status" in data and "data" in data:
@@ -672,11 +831,29 @@ class OneBotClient:
         except Exception as e:
             print(f"处理消息失败: {e}")
     
-    def process_chat_message(self, data):
+    def process_chat_message(self, data, archive_only=False):
+        """保存并显示一条聊天消息；archive_only 时只保存，不解析昵称、不获取群成员、不更新界面"""
         # 获取消息内容和发送者信息
         message_id = data.get("message_id")
         message = data.get("raw_message", "")
-        time_str = datetime.datetime.now().strftime("%H:%M:%S")
+        # 使用事件自带的时间，缺失时才使用本地时间
+        timestamp = data.get("time") or time.time()
+        if data.get("self_id"):
+            self.self_id = str(data["self_id"])
+        
+        # 重连或服务端重发的消息在昵称解析、保存和显示之前过滤掉
+        if data["message_type"] == "private":
+            conversation_id = str(data.get("user_id"))
+        else:
+            conversation_id = f"group_{data.get('group_id')}"
+        conv = self.conversations.get(conversation_id) or {"id": conversation_id, "messages": []}
+        if self.deduplicator.is_duplicate(conv, message_id, timestamp):
+            print(f"忽略重复消息: {conversation_id}, message_id={message_id}")
+            return
+        
+        if archive_only:
+            self.archive_chat_message(data, conv, conversation_id, timestamp)
+            return
         
         if data["message_type"] == "private":
             # 私聊消息
@@ -728,24 +905,46 @@ class OneBotClient:
                 "avatar": avatar,
                 "messages": []
             }
-            self.root.after(0, lambda: self.add_conversation_to_sidebar(conversation_id, name, avatar))
+            self.root.after(0, lambda: self.add_conversation_to_sidebar(conversation_id, name, avatar, timestamp))
         
         # 添加消息
-        self.conversations[conversation_id]["messages"].append({
-            "sender": nickname,
-            "content": message,
-            "time": time_str,
-            "is_self": False
-        })
+        msg = ChatMessage(timestamp, user_id, nickname, message, False, message_id)
+        self.storage.append(self.conversations[conversation_id], msg)
+        self.search_index.add(conversation_id, msg)
         
         # 保存聊天记录
         self.save_chat_history(conversation_id)
         
-        # 如果当前正在查看此对话，显示消息
-        if self.current_conversation == conversation_id:
-            self.root.after(0, lambda: self.display_message(nickname, message, time_str, False))
-            self.root.after(0, lambda: self.chat_canvas.yview_moveto(1.0))
+        # 对话移到列表顶部，不在查看的对话增加未读数
+        is_current = self.current_conversation == conversation_id
+        self.root.after(0, lambda: self.conversation_list.touch(conversation_id, msg.timestamp, unread=not is_current))
+        
+        # 如果当前正在查看此对话，显示消息；否则在后台预取消息中的图片
+        if is_current:
+            self.root.after(0, lambda: self.append_live_message(msg))
+        elif self.config.get("image_prefetch", True):
+            for url in image_urls(message):
+                self.image_loader.prefetch(url)
             
+    def archive_chat_message(self, data, conv, conversation_id, timestamp):
+        """只存档的消息：昵称直接取自事件，不触发任何界面更新"""
+        user_id = str(data.get("user_id"))
+        sender = data.get("sender") if isinstance(data.get("sender"), dict) else {}
+        nickname = sender.get("card") or sender.get("nickname") or user_id
+        
+        if conversation_id not in self.conversations:
+            is_group = data["message_type"] == "group"
+            conv["name"] = self.get_group_name(str(data.get("group_id"))) if is_group else nickname
+            conv["avatar"] = "👥" if is_group else "👤"
+            self.conversations[conversation_id] = conv
+            # 只在第一次出现时加入对话列表，之后的消息不再更新列表顺序和未读数
+            self.root.after(0, lambda: self.add_conversation_to_sidebar(conversation_id, conv["name"], conv["avatar"]))
+        
+        msg = ChatMessage(timestamp, user_id, nickname, data.get("raw_message", ""), False, data.get("message_id"))
+        self.storage.append(conv, msg)
+        self.search_index.add(conversation_id, msg)
+        self.save_chat_history(conversation_id)
+    
     def get_group_member_nickname(self, group_id, user_id):
         """获取群成员昵称"""
         print(f"获取群成员昵称 - group_id: {group_id}, user_id: {user_id}")
@@ -838,64 +1037,84 @@ class OneBotClient:
         if "data" in data and isinstance(data["data"], list) and data["data"]:
             # 判断是好友列表还是群列表还是群成员列表
             first_item = data["data"][0]
+            # 与联系人快照比较，只有新增或改名的对话需要更新到对话列表
+            entries = []
             if "user_id" in first_item and "nickname" in first_item and "group_id" not in first_item:
                 # 好友列表
-                for friend in data["data"]:
-                    user_id = str(friend["user_id"])
-                    nickname = friend["nickname"]
-                    conversation_id = user_id
-                    
-                    if conversation_id not in self.conversations:
-                        self.conversations[conversation_id] = {
-                            "id": conversation_id,
-                            "name": nickname,
-                            "avatar": "👤",
-                            "messages": []
-                        }
-                        self.root.after(0, lambda cid=conversation_id, name=nickname: 
-                                      self.add_conversation_to_sidebar(cid, name, "👤"))
-                    else:
-                        # 更新名称
-                        self.conversations[conversation_id]["name"] = nickname
+                friends = {str(friend["user_id"]): friend["nickname"] for friend in data["data"]}
+                changed, removed = self.contacts.update("friends", friends, self.self_id)
+                entries = self.update_conversations(changed, "", "👤")
+                self.remove_conversations(removed)
             
             elif "group_id" in first_item and "group_name" in first_item and "user_id" not in first_item:
                 # 群列表
-                for group in data["data"]:
-                    group_id = str(group["group_id"])
-                    group_name = group["group_name"]
-                    conversation_id = f"group_{group_id}"
-                    
-                    if conversation_id not in self.conversations:
-                        self.conversations[conversation_id] = {
-                            "id": conversation_id,
-                            "name": group_name,
-                            "avatar": "👥",
-                            "messages": []
-                        }
-                        self.root.after(0, lambda cid=conversation_id, name=group_name: 
-                                      self.add_conversation_to_sidebar(cid, name, "👥"))
-                    else:
-                        # 更新名称
-                        self.conversations[conversation_id]["name"] = group_name
+                groups = {str(group["group_id"]): group["group_name"] for group in data["data"]}
+                changed, removed = self.contacts.update("groups", groups, self.self_id)
+                entries = self.update_conversations(changed, "group_", "👥")
+                self.remove_conversations(f"group_{group_id}" for group_id in removed)
             
-            elif "group_id" in first_item and "user_id" in first_item and "nickname" in first_item:
+            if entries:
+                self.root.after(0, lambda: self.conversation_list.add_many(entries))
+            
+            if "group_id" in first_item and "user_id" in first_item and "nickname" in first_item:
                 # 群成员列表
                 group_id = str(first_item["group_id"])
-                self.group_members[group_id] = {}
-                
-                for member in data["data"]:
-                    user_id = str(member["user_id"])
-                    self.group_members[group_id][user_id] = {
+                members = {
+                    str(member["user_id"]): {
                         "nickname": member.get("nickname", ""),
                         "card": member.get("card", ""),  # 群名片
                         "role": member.get("role", "member")
                     }
+                    for member in data["data"]
+                }
+                changed, removed = self.contacts.update_members(group_id, members)
+                self.group_members[group_id] = members
                 
                 # 如果当前正在查看这个群，重新显示消息以更新昵称
                 if self.current_conversation == f"group_{group_id}":
-                    self.root.after(0, lambda: messagebox.showinfo("成功", f"群成员列表更新成功，共{len(data['data'])}人"))
-                    # 重新加载消息以显示正确的昵称
-                    self.root.after(0, lambda: self.select_conversation(self.current_conversation))
+                    count = len(changed) + len(removed)
+                    self.root.after(0, lambda: messagebox.showinfo("成功", f"群成员列表更新成功，共{len(members)}人，{count}人有变化"))
+                    # 有成员变化时才重新加载消息以显示正确的昵称
+                    if count:
+                        self.root.after(0, lambda: self.select_conversation(self.current_conversation))
+    
+    def remove_conversations(self, conversation_ids):
+        """好友或群已不存在时从对话列表中移除
+
+        有聊天记录的对话保留（记录仍在磁盘上，下次启动也会加载），只移除仅来自联系人列表的空对话。
+        """
+        removed = []
+        for conversation_id in conversation_ids:
+            conv = self.conversations.get(conversation_id)
+            if conv is None or conversation_id == self.current_conversation:
+                continue
+            if conv.get("messages") or self.storage.total_count(conv) or \
+                    os.path.exists(os.path.join(self.storage.history_dir, f"{conversation_id}.json")):
+                continue
+            del self.conversations[conversation_id]
+            removed.append(conversation_id)
+        if removed:
+            self.root.after(0, lambda: self.conversation_list.remove_many(removed))
+    
+    def update_conversations(self, items, prefix, avatar):
+        """按 {ID: 名称} 新建或改名对话，返回需要更新到对话列表的项"""
+        entries = []
+        for item_id, name in items.items():
+            conversation_id = prefix + item_id
+            conv = self.conversations.get(conversation_id)
+            if conv is None:
+                self.conversations[conversation_id] = {
+                    "id": conversation_id,
+                    "name": name,
+                    "avatar": avatar,
+                    "messages": []
+                }
+                entries.append((conversation_id, name, avatar, 0))
+            elif conv["name"] != name:
+                # 更新名称
+                conv["name"] = name
+                entries.append((conversation_id, name, avatar, None))
+        return entries
     
     def get_user_nickname(self, user_id):
         """获取用户昵称"""
@@ -914,15 +1133,293 @@ class OneBotClient:
         asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
 
+class ConversationList(ttk.Frame):
+    """虚拟化的对话列表
+
+    对话按最近活跃时间排序保存在有序列表中（二分查找定位），新消息到达时
+    只移动对应的一项。列表绘制在 Canvas 上，每次只为可见的几十行创建图形项，
+    对话数量再多也不会创建大量控件。
+    """
+    
+    ROW_HEIGHT = 36
+    
+    def __init__(self, parent, on_select, bg="#f5f5f5"):
+        super().__init__(parent)
+        self.on_select = on_select
+        self.bg = bg
+        self.items = {}  # 对话ID -> [名称, 头像, 排序键]
+        self.order = []  # 排序键列表：(-最近活跃时间, 对话ID)
+        self.unread = {}
+        self.selected = None
+        self.filter_text = ""
+        self.filtered = None  # 过滤后的对话ID列表，没有过滤时为 None
+        self._redraw_pending = False
+        
+        self.canvas = tk.Canvas(self, bg=bg, width=200, highlightthickness=0, yscrollincrement=self.ROW_HEIGHT)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.canvas.config(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.canvas.bind("<Configure>", lambda e: self.schedule_redraw())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.yview("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+    
+    def add_many(self, entries):
+        """添加或更新对话，entries 为 (对话ID, 名称, 头像, 最近活跃时间) 列表
+
+        最近活跃时间为 None 时只更新名称，不改变排序
+        """
+        for conversation_id, name, avatar, last_active in entries:
+            item = self.items.get(conversation_id)
+            if item is None:
+                key = (-(last_active or 0), conversation_id)
+                self.items[conversation_id] = [name, avatar, key]
+                bisect.insort(self.order, key)
+            else:
+                item[0], item[1] = name, avatar
+                if last_active is not None and -last_active < item[2][0]:
+                    self._move(conversation_id, last_active)
+        self._invalidate_filter()
+    
+    def remove_many(self, conversation_ids):
+        """移除对话"""
+        for conversation_id in conversation_ids:
+            item = self.items.pop(conversation_id, None)
+            if item is None:
+                continue
+            del self.order[bisect.bisect_left(self.order, item[2])]
+            self.unread.pop(conversation_id, None)
+            if self.selected == conversation_id:
+                self.selected = None
+        self._invalidate_filter()
+    
+    def touch(self, conversation_id, timestamp, unread=False):
+        """对话有新消息时移到列表顶部"""
+        if conversation_id not in self.items:
+            return
+        if unread:
+            self.unread[conversation_id] = self.unread.get(conversation_id, 0) + 1
+        if -timestamp < self.items[conversation_id][2][0]:
+            self._move(conversation_id, timestamp)
+            if self.filtered is not None:
+                self._invalidate_filter()
+                return
+        self.schedule_redraw()
+    
+    def _move(self, conversation_id, timestamp):
+        item = self.items[conversation_id]
+        index = bisect.bisect_left(self.order, item[2])
+        del self.order[index]
+        item[2] = (-timestamp, conversation_id)
+        bisect.insort(self.order, item[2])
+    
+    def set_selected(self, conversation_id):
+        self.selected = conversation_id
+        self.unread.pop(conversation_id, None)
+        self.schedule_redraw()
+    
+    def _matches(self, conversation_id, text):
+        return text in self.items[conversation_id][0].lower() or text in conversation_id
+    
+    def set_filter(self, text):
+        """按名称或ID过滤；输入内容在原有过滤条件上追加字符时只在上次结果中筛选"""
+        text = text.strip().lower()
+        if not text:
+            self.filtered = None
+        elif self.filtered is not None and self.filter_text and text.startswith(self.filter_text):
+            self.filtered = [cid for cid in self.filtered if self._matches(cid, text)]
+        else:
+            self.filtered = [key[1] for key in self.order if self._matches(key[1], text)]
+        self.filter_text = text
+        self.canvas.yview_moveto(0)
+        self.schedule_redraw()
+    
+    def _invalidate_filter(self):
+        if self.filtered is not None:
+            self.filtered = [key[1] for key in self.order if self._matches(key[1], self.filter_text)]
+        self.schedule_redraw()
+    
+    def _row(self, index):
+        if self.filtered is not None:
+            return self.filtered[index]
+        return self.order[index][1]
+    
+    def __len__(self):
+        return len(self.filtered) if self.filtered is not None else len(self.order)
+    
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_redraw()
+    
+    def on_click(self, event):
+        index = int(self.canvas.canvasy(event.y) // self.ROW_HEIGHT)
+        if 0 <= index < len(self):
+            self.on_select(self._row(index))
+    
+    def schedule_redraw(self):
+        # 合并同一轮事件中的多次更新
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self.redraw)
+    
+    def redraw(self):
+        """只绘制可见范围内的行"""
+        self._redraw_pending = False
+        canvas = self.canvas
+        width = max(canvas.winfo_width(), 1)
+        height = max(canvas.winfo_height(), 1)
+        count = len(self)
+        canvas.config(scrollregion=(0, 0, width, max(count * self.ROW_HEIGHT, height)))
+        canvas.delete("row")
+        
+        first = max(0, int(canvas.canvasy(0) // self.ROW_HEIGHT))
+        last = min(count, first + height // self.ROW_HEIGHT + 2)
+        for index in range(first, last):
+            conversation_id = self._row(index)
+            name, avatar, _ = self.items[conversation_id]
+            top = index * self.ROW_HEIGHT
+            if conversation_id == self.selected:
+                canvas.create_rectangle(0, top, width, top + self.ROW_HEIGHT, fill="#dbe9f8", width=0, tags="row")
+            canvas.create_text(18, top + self.ROW_HEIGHT // 2, text=avatar, font=("微软雅黑", 14), tags="row")
+            canvas.create_text(40, top + self.ROW_HEIGHT // 2, text=name, anchor="w",
+                               font=("微软雅黑", 10), width=width - 80, tags="row")
+            unread = self.unread.get(conversation_id)
+            if unread:
+                center = top + self.ROW_HEIGHT // 2
+                canvas.create_oval(width - 34, center - 9, width - 10, center + 9, fill="#e53935", width=0, tags="row")
+                canvas.create_text(width - 22, center, text=str(unread) if unread < 100 else "99+",
+                                   fill="#ffffff", font=("微软雅黑", 8), tags="row")
+
+class SearchDialog(tk.Toplevel):
+    """消息搜索窗口，结果分页显示，双击打开对应的消息"""
+    
+    def __init__(self, client, query=""):
+        super().__init__(client.root)
+        self.client = client
+        self.title("搜索消息")
+        self.geometry("520x420")
+        self.page = 0
+        self.page_size = 20
+        self.total = 0
+        self.hits = []
+        
+        query_frame = ttk.Frame(self)
+        query_frame.pack(fill=tk.X, padx=10, pady=5)
+        self.query_entry = ttk.Entry(query_frame)
+        self.query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        self.query_entry.insert(0, query)
+        self.query_entry.bind("<Return>", lambda e: self.run_search(0))
+        ttk.Button(query_frame, text="搜索", command=lambda: self.run_search(0)).pack(side=tk.RIGHT)
+        
+        self.result_list = tk.Listbox(self, font=("微软雅黑", 10), activestyle="none")
+        self.result_list.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.result_list.bind("<Double-Button-1>", self.open_selected)
+        self.result_list.bind("<Return>", self.open_selected)
+        
+        nav_frame = ttk.Frame(self)
+        nav_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(nav_frame, text="上一页", command=lambda: self.run_search(self.page - 1)).pack(side=tk.LEFT)
+        self.status_label = ttk.Label(nav_frame, text="")
+        self.status_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+        ttk.Button(nav_frame, text="下一页", command=lambda: self.run_search(self.page + 1)).pack(side=tk.RIGHT)
+        
+        self.query_entry.focus_set()
+        if query:
+            self.run_search(0)
+    
+    def run_search(self, page):
+        query = self.query_entry.get().strip()
+        if not query:
+            return
+        if not self.client.search_index.ready:
+            self.status_label.config(text="搜索索引正在加载，请稍候...")
+            return
+        
+        pages = max(1, (self.total + self.page_size - 1) // self.page_size)
+        if page < 0 or (page > 0 and page >= pages):
+            return
+        
+        self.total, self.hits = self.client.search_index.search(query, page, self.page_size)
+        self.page = page
+        self.result_list.delete(0, tk.END)
+        
+        # 只读取当前页命中的消息用于显示摘要
+        for hit in self.hits:
+            conv = self.client.conversations.get(hit.conversation_id)
+            name = conv["name"] if conv else hit.conversation_id
+            msg = self.client.storage.find_message(conv, hit.timestamp, hit.message_id)[1] if conv else None
+            snippet = msg.content.replace("\n", " ")[:40] if msg else ""
+            sender = msg.sender if msg else ""
+            time_str = datetime.datetime.fromtimestamp(hit.timestamp).strftime("%Y-%m-%d %H:%M")
+            self.result_list.insert(tk.END, f"[{name}] {time_str} {sender}: {snippet}")
+        
+        pages = max(1, (self.total + self.page_size - 1) // self.page_size)
+        self.status_label.config(text=f"共{self.total}条结果，第{self.page + 1}/{pages}页")
+    
+    def open_selected(self, event=None):
+        selection = self.result_list.curselection()
+        if selection:
+            self.client.open_search_hit(self.hits[selection[0]])
+
+class JumpToDateDialog(simpledialog.Dialog):
+    def __init__(self, parent):
+        self.result = None
+        super().__init__(parent, title="跳转到日期")
+    
+    def body(self, master):
+        ttk.Label(master, text="日期 (YYYY-MM-DD):").grid(row=0, sticky=tk.W, pady=5)
+        ttk.Label(master, text="结束日期 (可选):").grid(row=1, sticky=tk.W, pady=5)
+        
+        self.start_entry = ttk.Entry(master, width=20)
+        self.start_entry.grid(row=0, column=1, sticky=tk.EW, pady=5)
+        self.start_entry.insert(0, datetime.date.today().strftime("%Y-%m-%d"))
+        
+        self.end_entry = ttk.Entry(master, width=20)
+        self.end_entry.grid(row=1, column=1, sticky=tk.EW, pady=5)
+        
+        return self.start_entry
+    
+    def validate(self):
+        try:
+            start = datetime.datetime.strptime(self.start_entry.get().strip(), "%Y-%m-%d").date()
+            end_text = self.end_entry.get().strip()
+            end = datetime.datetime.strptime(end_text, "%Y-%m-%d").date() if end_text else None
+        except ValueError:
+            messagebox.showerror("错误", "日期格式应为 YYYY-MM-DD", parent=self)
+            return False
+        if end and end < start:
+            messagebox.showerror("错误", "结束日期不能早于开始日期", parent=self)
+            return False
+        self.dates = (start, end)
+        return True
+    
+    def apply(self):
+        self.result = self.dates
+
 class ConfigDialog(simpledialog.Dialog):
     def __init__(self, parent, config):
         self.config = config.copy()
         self.result = None
         super().__init__(parent, title="服务器设置")
     
+    # 连接方式显示名称 -> 配置值
+    MODES = {
+        "正向WebSocket": "forward",
+        "反向WebSocket": "reverse_ws",
+        "HTTP POST": "http_post"
+    }
+    
     def body(self, master):
         ttk.Label(master, text="WebSocket服务器地址:").grid(row=0, sticky=tk.W, pady=5)
         ttk.Label(master, text="访问令牌:").grid(row=1, sticky=tk.W, pady=5)
+        ttk.Label(master, text="连接方式:").grid(row=3, sticky=tk.W, pady=5)
+        ttk.Label(master, text="监听地址:").grid(row=4, sticky=tk.W, pady=5)
+        ttk.Label(master, text="监听端口:").grid(row=5, sticky=tk.W, pady=5)
+        ttk.Label(master, text="签名密钥 (HTTP POST):").grid(row=6, sticky=tk.W, pady=5)
+        ttk.Label(master, text="HTTP API地址 (可选):").grid(row=7, sticky=tk.W, pady=5)
         
         self.server_entry = ttk.Entry(master, width=40)
         self.server_entry.grid(row=0, column=1, sticky=tk.EW, pady=5)
@@ -936,16 +1433,55 @@ class ConfigDialog(simpledialog.Dialog):
         self.auto_reconnect_check = ttk.Checkbutton(master, text="自动重连", variable=self.auto_reconnect_var)
         self.auto_reconnect_check.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=5)
         
+        mode = self.config.get("connection_mode", "forward")
+        self.mode_var = tk.StringVar(value=next((k for k, v in self.MODES.items() if v == mode), "正向WebSocket"))
+        mode_box = ttk.Combobox(master, textvariable=self.mode_var, values=list(self.MODES), state="readonly")
+        mode_box.grid(row=3, column=1, sticky=tk.EW, pady=5)
+        
+        self.listen_host_entry = ttk.Entry(master, width=40)
+        self.listen_host_entry.grid(row=4, column=1, sticky=tk.EW, pady=5)
+        self.listen_host_entry.insert(0, self.config.get("listen_host", "127.0.0.1"))
+        
+        self.listen_port_entry = ttk.Entry(master, width=40)
+        self.listen_port_entry.grid(row=5, column=1, sticky=tk.EW, pady=5)
+        self.listen_port_entry.insert(0, str(self.config.get("listen_port", 8081)))
+        
+        self.secret_entry = ttk.Entry(master, width=40)
+        self.secret_entry.grid(row=6, column=1, sticky=tk.EW, pady=5)
+        self.secret_entry.insert(0, self.config.get("secret", ""))
+        
+        self.http_api_entry = ttk.Entry(master, width=40)
+        self.http_api_entry.grid(row=7, column=1, sticky=tk.EW, pady=5)
+        self.http_api_entry.insert(0, self.config.get("http_api_url", ""))
+        
         return self.server_entry
     
+    def validate(self):
+        try:
+            int(self.listen_port_entry.get())
+        except ValueError:
+            messagebox.showerror("错误", "监听端口必须是数字", parent=self)
+            return False
+        return True
+    
     def apply(self):
-        self.result = {
+        # 保留对话框中没有的其他配置项
+        self.result = dict(self.config)
+        self.result.update({
             "websocket_server": self.server_entry.get(),
             "token": self.token_entry.get(),
-            "auto_reconnect": self.auto_reconnect_var.get()
-        }
+            "auto_reconnect": self.auto_reconnect_var.get(),
+            "connection_mode": self.MODES[self.mode_var.get()],
+            "listen_host": self.listen_host_entry.get().strip(),
+            "listen_port": int(self.listen_port_entry.get()),
+            "secret": self.secret_entry.get(),
+            "http_api_url": self.http_api_entry.get().strip()
+        })
 
-if __name__ == "__main__":
+def main():
     root = tk.Tk()
     app = OneBotClient(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
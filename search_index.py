@@ -0,0 +1,219 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+
+# CQ码（图片、表情等）不参与索引
+CQ_CODE_PATTERN = re.compile(r'\[CQ:[^\]]*\]')
+# 中日韩文字按字符二元组切分，其他文字按单词切分
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """把消息文本切分为索引词条
+
+    中文等连续的CJK文字切分为相邻两个字的二元组（单独一个字时保留单字），
+    其他文字按单词切分并转为小写。
+    """
+    text = CQ_CODE_PATTERN.sub(" ", text).lower()
+    tokens = []
+    for part in CJK_PATTERN.split(text):
+        tokens.extend(WORD_PATTERN.findall(part))
+    for run in CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def index_terms(text):
+    """写入索引的词条：除 tokenize 的结果外，每个CJK单字也作为词条，用于单字查询"""
+    tokens = set(tokenize(text))
+    for run in CJK_PATTERN.findall(CQ_CODE_PATTERN.sub(" ", text)):
+        tokens.update(run)
+    return tokens
+
+
+class SearchHit:
+    __slots__ = ("conversation_id", "timestamp", "message_id", "score")
+
+    def __init__(self, conversation_id, timestamp, message_id, score):
+        self.conversation_id = conversation_id
+        self.timestamp = timestamp
+        self.message_id = message_id
+        self.score = score
+
+
+class SearchIndex:
+    """跨对话的全文检索倒排索引
+
+    每条消息是一个文档。文档和倒排表都保存在 ``index_dir/index.db``（SQLite）中，
+    倒排表按 (词条, 文档编号) 聚簇存储，查询时只读取相关词条的记录，内存占用与
+    消息总量无关，启动时也不需要回放整个索引。数据库不存在或上次没有构建完成时，
+    从聊天记录中全量构建一次。
+
+    ``open`` 完成之前加入的消息先排队，确定索引是否需要重建后再写入（重建时这些
+    消息已包含在聊天记录中，由构建过程写入）。同一条消息（对话、时间和消息ID都相同）
+    只写入一次：重建时取快照之前已写入聊天记录、之后才调用 ``add`` 的消息会被跳过。
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, conversation TEXT, timestamp INTEGER, message_id)",
+        "CREATE TABLE IF NOT EXISTS postings (term TEXT, doc INTEGER, PRIMARY KEY (term, doc)) WITHOUT ROWID",
+        # 自己发送的消息没有消息ID，按对话和时间区分
+        "CREATE UNIQUE INDEX IF NOT EXISTS docs_key ON docs (conversation, timestamp, IFNULL(message_id, ''))",
+    )
+
+    def __init__(self, index_dir="search_index"):
+        self.index_dir = index_dir
+        self.lock = threading.RLock()
+        self.ready = False
+        self._db = None
+        self._pending = []  # open 完成前加入的消息
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _connect(self):
+        if not os.path.exists(self.index_dir):
+            os.makedirs(self.index_dir)
+        # 连接在多个线程中使用，访问都由 self.lock 串行化
+        db = sqlite3.connect(self._path("index.db"), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            db.execute(statement)
+        db.commit()
+        return db
+
+    def __len__(self):
+        with self.lock:
+            if self._db is None:
+                return 0
+            return self._db.execute("SELECT COALESCE(MAX(id), 0) FROM docs").fetchone()[0]
+
+    def open(self, storage, conversations):
+        """打开索引，不存在或不完整时从聊天记录重建（耗时，应在后台线程调用）
+
+        conversations 是对话字典（ID -> 对话），在确定需要重建时才取快照。
+        """
+        with self.lock:
+            self._db = self._connect()
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+            if row is not None:
+                pending, self._pending = self._pending, []
+                self._write(pending)
+                self.ready = True
+                return
+
+            # 重建：先确定每个对话现有的消息数量，之后新到达的消息由 add 直接加入索引；
+            # 排队的消息已经在聊天记录中，由下面的构建过程写入
+            self._db.execute("DELETE FROM docs")
+            self._db.execute("DELETE FROM postings")
+            self._db.commit()
+            self._pending = []
+            snapshot = [(conv, storage.total_count(conv)) for conv in list(conversations.values())]
+            self.ready = True
+
+        print("正在构建搜索索引...")
+        for conv, count in snapshot:
+            for start in range(0, count, 500):
+                batch = [
+                    (conv["id"], msg.timestamp, msg.message_id, index_terms(msg.content))
+                    for msg in storage.read_messages(conv, start, min(count, start + 500))
+                ]
+                with self.lock:
+                    self._write(batch)
+        with self.lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+            self._db.commit()
+        print(f"搜索索引构建完成，共{len(self)}条消息")
+
+    def _write(self, documents):
+        """写入一批文档（调用时已持有锁）"""
+        for conversation_id, timestamp, message_id, terms in documents:
+            if not terms:
+                continue
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO docs (conversation, timestamp, message_id) VALUES (?, ?, ?)",
+                (conversation_id, timestamp, message_id)
+            )
+            if not cursor.rowcount:
+                continue  # 已经在索引中
+            doc_id = cursor.lastrowid
+            self._db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?)", ((t, doc_id) for t in terms))
+        self._db.commit()
+
+    def add(self, conversation_id, msg):
+        """把一条消息加入索引"""
+        terms = index_terms(msg.content)
+        if not terms:
+            return
+        with self.lock:
+            document = (conversation_id, msg.timestamp, msg.message_id, terms)
+            if not self.ready:
+                self._pending.append(document)
+                return
+            self._write([document])
+
+    def search(self, query, page=0, page_size=20):
+        """检索消息，返回 (命中总数, 当前页的 SearchHit 列表)
+
+        排序依据：命中的查询词条越多越靠前，其次按 IDF 加权得分，最后按时间从新到旧。
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return 0, []
+
+        with self.lock:
+            if self._db is None:
+                return 0, []
+            total_docs = max(1, len(self))
+            weights = []
+            for token in query_tokens:
+                count = self._db.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (token,)).fetchone()[0]
+                if count:
+                    weights.append((token, math.log(1 + total_docs / count)))
+            if not weights:
+                return 0, []
+
+            # 查询较长时至少要命中一半的词条，避免大量只命中一个常见二元组的结果
+            threshold = max(1, (len(query_tokens) + 1) // 2)
+            values = ", ".join("(?, ?)" for _ in weights)
+            params = [value for pair in weights for value in pair]
+            matched = (
+                f"WITH query(term, idf) AS (VALUES {values}) "
+                "SELECT p.doc AS doc, COUNT(*) AS matched, SUM(query.idf) AS score "
+                "FROM query JOIN postings p ON p.term = query.term "
+                "GROUP BY p.doc HAVING COUNT(*) >= ?"
+            )
+            params.append(threshold)
+            total = self._db.execute(f"SELECT COUNT(*) FROM ({matched})", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT d.conversation, d.timestamp, d.message_id, m.score FROM ({matched}) m "
+                "JOIN docs d ON d.id = m.doc "
+                "ORDER BY m.matched DESC, m.score DESC, d.timestamp DESC LIMIT ? OFFSET ?",
+                params + [page_size, page * page_size]
+            ).fetchall()
+            return total, [SearchHit(*row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def invalidate(self):
+        """删除完成标记，下次启动时从聊天记录重建索引（例如导入聊天记录之后）"""
+        with self.lock:
+            if not os.path.exists(self._path("index.db")):
+                return
+            db = self._db or self._connect()
+            db.execute("DELETE FROM meta WHERE key = 'complete'")
+            db.commit()
+            if db is not self._db:
+                db.close()
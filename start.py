@@ -1,19 +1,32 @@
+import hashlib
+import importlib.util
 import os
 import subprocess
 import sys
 
+# 需要检查的依赖（导入时使用的模块名）
+REQUIRED_MODULES = ["websockets", "psutil", "requests", "PIL"]
+# 依赖检查通过后写入的标记文件，依赖列表或Python解释器变化时重新检查
+DEPS_STAMP = ".deps_checked"
+
+def dependencies_stamp():
+    with open('requirements.txt', 'rb') as f:
+        requirements = f.read()
+    return hashlib.md5(requirements + sys.executable.encode() + sys.version.encode()).hexdigest()
+
 # 检查并安装依赖
 def install_dependencies():
+    stamp = dependencies_stamp()
+    if os.path.exists(DEPS_STAMP):
+        with open(DEPS_STAMP, 'r') as f:
+            if f.read().strip() == stamp:
+                return
+
     print("正在检查依赖...")
-    try:
-        # 尝试导入websockets，如果失败则安装
-        import websockets
-        import psutil
-        import requests
-        import PIL
-        print("依赖已安装，正在启动程序...")
-    except ImportError:
-        print("正在安装依赖...")
+    # 只查找模块而不导入，避免启动时加载这些较大的库
+    missing = [name for name in REQUIRED_MODULES if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"正在安装依赖: {', '.join(missing)}")
         try:
             subprocess.check_call([sys.executable, '-m', 'pip', 'install', '-r', 'requirements.txt'])
             print("依赖安装成功！")
@@ -23,14 +36,21 @@ def install_dependencies():
             input("按回车键退出...")
             sys.exit(1)
 
-# 启动主程序
+    with open(DEPS_STAMP, 'w') as f:
+        f.write(stamp)
+    print("依赖已安装，正在启动程序...")
+
+# 启动主程序（在当前进程中运行，不再启动第二个解释器）
 def start_app():
     try:
-        subprocess.run([sys.executable, 'onebot_client.py'])
+        import onebot_client
+        onebot_client.main()
     except Exception as e:
         print(f"启动程序失败: {e}")
         input("按回车键退出...")
 
 if __name__ == "__main__":
+    # 配置文件和聊天记录都使用相对路径，切换到程序所在目录
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
     install_dependencies()
-    start_app()
\ No newline at end of file
+    start_app()